@@ -1,7 +1,8 @@
+from hmac import compare_digest
 from logging import getLogger
 
-from fastapi import FastAPI, Request
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Request, Header
+from fastapi.responses import RedirectResponse, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException
 from fastapi.responses import JSONResponse
@@ -11,7 +12,12 @@ from tortoise.contrib.fastapi import register_tortoise
 
 from routes.auth import router as auth_router
 from routes.report import router as report_router
+from routes.agents import router as agents_router
+from routes.reports import router as reports_router
 from utils.db import TORTOISE_ORM
+from utils.env import env
+from utils.loop import monitor
+from utils.metrics import registry
 from utils import ResponseModel
 
 logger = getLogger()
@@ -19,6 +25,16 @@ app = FastAPI()
 
 register_tortoise(app, config=TORTOISE_ORM, generate_schemas=True, add_exception_handlers=True)
 
+
+@app.on_event('startup')
+async def start_monitor():
+    monitor.start() if monitor.threshold else ...
+
+
+@app.on_event('shutdown')
+async def stop_monitor():
+    monitor.stop()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=['http://localhost:4200', "https://moniewatch.web.app", "https://localhost:4200"],
@@ -42,6 +58,16 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 app.include_router(auth_router)
 app.include_router(report_router)
+app.include_router(agents_router)
+app.include_router(reports_router)
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics(authorization: str = Header("")):
+    """Prometheus scrape endpoint, only served to requests with `Authorization: Bearer <METRICS_TOKEN>`"""
+    if not env.METRICS_TOKEN or not compare_digest(authorization.encode(), f"Bearer {env.METRICS_TOKEN}".encode()):
+        return PlainTextResponse("Not Found", status_code=404)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get('/')
@@ -0,0 +1,50 @@
+"""Compare the per-row ingestion path that parsed upstream pages before Transaction.from_page with the batch path.
+
+    python -m benchmarks.ingest --rows 200000
+"""
+import argparse
+import time
+from datetime import datetime
+
+from utils.data_models import Transaction
+
+from .synthetic import raw_records
+
+
+def legacy(records: list[dict]) -> list[Transaction]:
+    def create(trans: dict) -> Transaction:
+        name = trans['agent']['businessName'].title()
+        time_ = datetime.strptime(trans['createdOn'], "%Y-%m-%dT%H:%M:%S.%f%z")
+        return Transaction(business_name=name, time=time_, trans_type=trans['transactionType'], amount=trans['amount'],
+                           agent_id=trans['agent']['id'])
+
+    return [create(trans) for trans in records if trans['status'] == "COMPLETED" and not trans['reversed'] and not trans['shouldBeReversed']]
+
+
+def timed(func, records: list[dict], repeat: int) -> tuple[float, list[Transaction]]:
+    best, result = float('inf'), []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(records)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--agents', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    records = raw_records(rows=args.rows, agents=args.agents)
+    old, expected = timed(legacy, records, args.repeat)
+    new, got = timed(Transaction.from_page, records, args.repeat)
+    assert got == expected, "batch ingestion does not match the legacy parser"
+    print(f"rows: {args.rows}  kept: {len(got)}")
+    print(f"legacy   {old:8.3f}s  {args.rows / old:12,.0f} rows/s")
+    print(f"batch    {new:8.3f}s  {args.rows / new:12,.0f} rows/s  ({old / new:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
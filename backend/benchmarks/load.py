@@ -0,0 +1,99 @@
+"""Drive ClientTransaction against the fake upstream and report requests per second and the time it takes to fetch every page.
+
+    python -m benchmarks.load --pages 200 --latency 0.05 --jitter 0.05 --concurrency 4 8 16 32
+    python -m benchmarks.load --pages 100 --max-in-flight 8 --retry-after 0.5 --error-rate 0.02 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import date
+
+from httpx import AsyncClient
+
+from utils.client import ClientTransaction
+from utils.data_models import Auth
+from utils.limiter import limits, RateLimits
+from utils.sessions import sessions
+
+from .upstream import FakeUpstream, UpstreamConfig
+
+URL = "http://upstream.test"
+
+
+async def fetch(upstream: FakeUpstream, *, concurrency: int, page_size: int, ordered: bool = False) -> dict:
+    """Log in and fetch every page of the consolidated transactions with fresh rate limiters and token cache"""
+    upstream.reset()
+    limits.limiters.clear()
+    limits.all = RateLimits().all
+    auth = Auth(username="load-test", password="secret")
+    await sessions.drop_token(auth.username)
+    client = ClientTransaction(auth, client=AsyncClient(transport=upstream.transport(), base_url=URL))
+    client.params['pageSize'] = page_size
+
+    pages = records = 0
+    error = ""
+    start = time.perf_counter()
+    try:
+        if not await client.authenticate():
+            raise ValueError("Unable to authenticate")
+        first = time.perf_counter()
+        async for page in client.iter_consolidated_transactions(start_date=date(2022, 12, 1), end_date=date(2022, 12, 31),
+                                                                 concurrency=concurrency, ordered=ordered):
+            pages += 1
+            records += len(page)
+    except ValueError as err:
+        first, error = time.perf_counter(), str(err)
+    finally:
+        await client.close()
+    elapsed = time.perf_counter() - start
+    stats = upstream.stats
+    return {'concurrency': concurrency, 'pages': pages, 'transactions': records, 'seconds': elapsed, 'login': first - start,
+            'requests': stats.requests, 'requests_per_second': stats.requests / elapsed, 'pages_per_second': pages / elapsed,
+            'statuses': {str(status): count for status, count in sorted(stats.statuses.items())}, 'peak_in_flight': stats.peak_in_flight,
+            'window': limits.get(auth.username).window, 'error': error}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=50, help="size the dataset to this many pages")
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--agents', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--ordered', action='store_true')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--max-in-flight', type=int, default=0)
+    parser.add_argument('--retry-after', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, help="per aggregator requests per second, API_RATE")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.rate:
+        os.environ['API_RATE'], os.environ['API_BURST'] = str(args.rate), str(max(1, int(args.rate)))
+    config = UpstreamConfig(agents=args.agents, rows=args.pages * args.page_size, seed=args.seed, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, throttle_rate=args.throttle_rate, max_in_flight=args.max_in_flight,
+                            retry_after=args.retry_after)
+    upstream = FakeUpstream(config)
+
+    results = []
+    print(f"{'concurrency':>11} {'pages':>6} {'seconds':>8} {'login':>6} {'requests':>9} {'req/s':>8} {'pages/s':>8} {'peak':>5} "
+          f"{'window':>6}  statuses")
+    for concurrency in args.concurrency:
+        result = asyncio.run(fetch(upstream, concurrency=concurrency, page_size=args.page_size, ordered=args.ordered))
+        results.append(result)
+        print(f"{concurrency:>11} {result['pages']:>6} {result['seconds']:>8.2f} {result['login']:>6.2f} {result['requests']:>9} "
+              f"{result['requests_per_second']:>8.1f} {result['pages_per_second']:>8.1f} {result['peak_in_flight']:>5} "
+              f"{result['window']:>6}  {result['statuses']} {result['error']}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'config': vars(config), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Benchmark the report pipeline on seeded synthetic data and save the results as JSON to compare between commits.
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --agents 10 1000 10000 --rows 1000 1000000 10000000 --compare before.json --output after.json
+
+Every scenario runs in a fresh process so that the peak RSS it reports is its own.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from datetime import datetime, timezone
+from itertools import product
+from multiprocessing import get_context
+from typing import Callable
+
+import numpy as np
+
+from models.transaction import Transactions, render
+from utils.data_models import Transaction
+from utils.memo import lazy
+from utils.task_queue import TaskQueue
+
+from . import synthetic
+
+CASES = ('create', 'data', 'table_data', 'below_target', 'report', 'fanout')
+
+
+def peak_rss() -> float:
+    """Peak resident set size of this process in MB, ru_maxrss is in bytes on macOS and in kilobytes elsewhere"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def measure(func: Callable[[], object], *, items: int, repeat: int, setup: Callable[[], object] | None = None) -> dict:
+    """Best and mean of `repeat` timed calls of func(setup()), setup is not timed"""
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {'seconds': best, 'mean': sum(times) / len(times), 'items': items, 'throughput': items / best if best else 0,
+            'peak_rss': peak_rss()}
+
+
+def target(*, rows: int, agents: int, active: float = 0.9) -> float:
+    """A target in naira that a few of the active agents miss"""
+    return rows / max(1, int(agents * active)) * 25_500 * 0.9
+
+
+def create(*, rows: int, agents: int, seed: int) -> tuple[float, int]:
+    """Seconds Transaction.create takes over `rows` raw records, generating the pages is not timed"""
+    elapsed = 0
+    for page in synthetic.raw_pages(rows=rows, agents=agents, seed=seed):
+        start = time.perf_counter()
+        [Transaction.create(trans) for trans in page]
+        elapsed += time.perf_counter() - start
+    return elapsed, rows
+
+
+async def fanout(count: int, workers: int) -> list:
+    async def task(agent_id: int) -> int:
+        await asyncio.sleep(0)
+        return agent_id
+
+    return await TaskQueue(task, [{'agent_id': i} for i in range(count)], workers=workers, name="benchmark").run()
+
+
+def run_scenario(*, agents: int, rows: int, seed: int = 0, repeat: int = 3, cases: tuple[str, ...] = CASES, workers: int = 100) -> dict:
+    """Time every case on one dataset, meant to run in a process of its own"""
+    result = {'agents': agents, 'rows': rows, 'seed': seed, 'baseline_rss': peak_rss(), 'cases': {}}
+    start = time.perf_counter()
+    roster = synthetic.agents(agents, seed=seed)
+    transactions = synthetic.transactions(rows=rows, agents=agents, seed=seed)
+    result['generate'] = time.perf_counter() - start
+    result['data_rss'] = peak_rss()
+
+    def views(warm: bool = True) -> Transactions:
+        lazy.shared.clear()
+        trans = Transactions(title="Benchmark", transactions=transactions, agents=roster, target=target(rows=rows, agents=agents))
+        trans.data if warm else ...
+        return trans
+
+    cases_ = result['cases']
+    if 'create' in cases:
+        elapsed, items = create(rows=rows, agents=agents, seed=seed)
+        cases_['create'] = {'seconds': elapsed, 'mean': elapsed, 'items': items, 'throughput': items / elapsed if elapsed else 0,
+                            'peak_rss': peak_rss()}
+    if 'data' in cases:
+        cases_['data'] = measure(lambda trans: trans.data, setup=lambda: views(warm=False), items=rows, repeat=repeat)
+    if 'table_data' in cases:
+        cases_['table_data'] = measure(lambda trans: trans.table_data(), setup=views, items=agents, repeat=repeat)
+    if 'below_target' in cases:
+        cases_['below_target'] = measure(lambda trans: trans.get_below_target_agents(), setup=views, items=agents, repeat=repeat)
+    if 'report' in cases:
+        cases_['report'] = measure(render, setup=lambda: replace(views().report_content(), author="Benchmark"), items=agents, repeat=repeat)
+    if 'fanout' in cases:
+        cases_['fanout'] = measure(lambda _: asyncio.run(fanout(agents, workers)), items=agents, repeat=repeat)
+    result['peak_rss'] = peak_rss()
+    return result
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain'], capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = "", False
+    return {'commit': commit, 'dirty': dirty, 'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def compare(baseline: dict, results: dict) -> list[str]:
+    """One line per case found in both runs, ratio is baseline seconds over current seconds so above 1 is faster"""
+    old = {(s['agents'], s['rows'], name): case for s in baseline['scenarios'] for name, case in s['cases'].items()}
+    lines = [f"{'agents':>7} {'rows':>10} {'case':<13} {'before':>10} {'after':>10} {'speedup':>8} {'rss before':>11} {'rss after':>10}"]
+    for scenario in results['scenarios']:
+        for name, case in scenario['cases'].items():
+            if (before := old.get((scenario['agents'], scenario['rows'], name))) is None:
+                continue
+            ratio = before['seconds'] / case['seconds'] if case['seconds'] else float('inf')
+            lines.append(f"{scenario['agents']:>7} {scenario['rows']:>10} {name:<13} {before['seconds']:>10.4f} {case['seconds']:>10.4f} "
+                         f"{ratio:>7.2f}x {before['peak_rss']:>10.0f}M {case['peak_rss']:>9.0f}M")
+    return lines
+
+
+def report(scenario: dict) -> list[str]:
+    lines = [f"agents {scenario['agents']}  rows {scenario['rows']}  generated in {scenario['generate']:.2f}s  "
+             f"peak rss {scenario['peak_rss']:.0f}MB"]
+    for name, case in scenario['cases'].items():
+        lines.append(f"  {name:<13} {case['seconds']:>10.4f}s  {case['throughput']:>14,.0f} items/s  peak rss {case['peak_rss']:.0f}MB")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--agents', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100_000])
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=100, help="TaskQueue workers in the fanout case")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = {'meta': metadata(), 'scenarios': []}
+    for agents, rows in product(args.agents, args.rows):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            scenario = executor.submit(run_scenario, agents=agents, rows=rows, seed=args.seed, repeat=args.repeat, cases=tuple(args.cases),
+                                       workers=args.workers).result()
+        results['scenarios'].append(scenario)
+        print("\n".join(report(scenario)), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            print("\n".join(compare(json.load(file), results)))
+
+
+if __name__ == '__main__':
+    main()
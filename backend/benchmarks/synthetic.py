@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+from random import Random
+from typing import Iterator
+
+import numpy as np
+
+from utils.data_models import Transaction, Agent, normalize_name
+
+TRANSACTION_TYPES = ("CASH_OUT", "CASH_IN", "AIRTIME", "TRANSFER", "BILL_PAYMENT", "CARD_PAYMENT")
+WAT = timezone(timedelta(hours=1))
+START = datetime(2022, 12, 1, tzinfo=WAT)
+
+
+def business_names(agents: int, rand: Random) -> list[str]:
+    return [f"{rand.choice(('ade', 'chuks', 'musa', 'bola'))} and sons enterprise {i}" for i in range(agents)]
+
+
+def raw_records(*, rows: int, agents: int = 100, days: int = 30, seed: int = 0, start: datetime = START) -> list[dict]:
+    """Consolidated transaction records shaped like the upstream API's"""
+    rand = Random(seed)
+    names = business_names(agents, rand)
+    records = []
+    for _ in range(rows):
+        agent = rand.randrange(agents)
+        time = start + timedelta(seconds=rand.randrange(days * 86400), milliseconds=rand.randrange(1000))
+        records.append({
+            'agent': {'id': 10000 + agent, 'businessName': names[agent]},
+            'createdOn': time.isoformat(timespec='milliseconds'),
+            'transactionType': rand.choice(TRANSACTION_TYPES),
+            'amount': rand.randint(100, 5_000_000),
+            'status': "COMPLETED" if rand.random() > 0.02 else "FAILED",
+            'reversed': rand.random() < 0.01,
+            'shouldBeReversed': False,
+        })
+    return records
+
+
+def raw_pages(*, rows: int, agents: int = 100, days: int = 30, seed: int = 0, page_size: int = 100_000) -> Iterator[list[dict]]:
+    """raw_records in pages, so that millions of records never have to be held at once"""
+    for page, i in enumerate(range(0, rows, page_size)):
+        yield raw_records(rows=min(page_size, rows - i), agents=agents, days=days, seed=seed * 1_000_003 + page)
+
+
+def agents(count: int, *, seed: int = 0) -> list[Agent]:
+    """The agents of an aggregator, ids and names match the ones `transactions` gives their transactions"""
+    names = business_names(count, Random(seed))
+    return [Agent(agent_id=10000 + i, name=normalize_name(name), mobile=2348000000000 + i) for i, name in enumerate(names)]
+
+
+def transactions(*, rows: int, agents: int = 100, active: float = 0.9, days: int = 30, seed: int = 0, start: datetime = START,
+                 chunk: int = 1_000_000) -> list[Transaction]:
+    """Parsed transactions of the first `active` share of `agents` agents, drawn with numpy so that ten million take seconds.
+
+    Amounts are in kobo like upstream's, so the mean total of an agent in naira is about rows / (agents * active) * 25,500.
+    """
+    names = [normalize_name(name) for name in business_names(agents, Random(seed))]
+    ids = list(range(10000, 10000 + agents))
+    active = max(1, int(agents * active))
+    rng = np.random.default_rng(seed)
+    result = []
+    for i in range(0, rows, chunk):
+        size = min(chunk, rows - i)
+        picks = rng.integers(active, size=size).tolist()
+        seconds = rng.integers(days * 86400, size=size).tolist()
+        types = rng.integers(len(TRANSACTION_TYPES), size=size).tolist()
+        amounts = rng.integers(100, 5_000_001, size=size).tolist()
+        result.extend(Transaction(names[agent], start + timedelta(seconds=second), TRANSACTION_TYPES[kind], ids[agent], amount)
+                      for agent, second, kind, amount in zip(picks, seconds, types, amounts))
+    return result
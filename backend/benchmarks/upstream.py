@@ -0,0 +1,188 @@
+"""A stand in for the aggregator API to load test ClientTransaction against.
+
+In process, through httpx.MockTransport:
+
+    client = ClientTransaction(auth, client=AsyncClient(transport=FakeUpstream(UpstreamConfig(rows=100_000)).transport(), base_url=url))
+
+Or over HTTP, configured from FAKE_UPSTREAM_* variables, for a backend started with API_URL=http://127.0.0.1:8001:
+
+    FAKE_UPSTREAM_ROWS=1000000 FAKE_UPSTREAM_LATENCY=0.2 uvicorn benchmarks.upstream:create_app --factory --port 8001
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass, field, fields
+from math import ceil
+from random import Random
+from uuid import uuid4
+
+from httpx import MockTransport, Request, Response
+
+from utils.env import env
+from utils.memo import LRU
+
+from . import synthetic
+
+
+@dataclass
+class UpstreamConfig:
+    """Size of the dataset and how badly the upstream behaves.
+
+    Every response is delayed by `latency` plus up to `jitter` seconds. Once more than `max_in_flight` requests are in progress
+    the rest are answered at once with a 429 carrying `retry_after`, and `throttle_rate` and `error_rate` of the remaining
+    requests fail with a 429 or a 500 at random. `password` None accepts any password.
+    """
+    agents: int = 100
+    rows: int = 10_000
+    seed: int = 0
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    max_in_flight: int = 0
+    retry_after: float = 0.0
+    token_ttl: float = 3600.0
+    password: str | None = None
+
+    @classmethod
+    def from_env(cls) -> 'UpstreamConfig':
+        values = {}
+        for item in fields(cls):
+            if (value := getattr(env, f"FAKE_UPSTREAM_{item.name}")) is not None:
+                values[item.name] = value if item.name == 'password' else type(item.default)(value)
+        return cls(**values)
+
+
+@dataclass
+class UpstreamStats:
+    requests: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    statuses: Counter = field(default_factory=Counter)
+    endpoints: Counter = field(default_factory=Counter)
+
+
+class FakeUpstream:
+    """The four endpoints ClientTransaction uses, with the upstream's responseCode and totalPages paging contract.
+
+    Transactions come from benchmarks.synthetic and are filtered on startDate, endDate and agentId, GET endpoints need a bearer
+    token from /auth/tokens and answer 401 without one.
+    """
+
+    def __init__(self, config: UpstreamConfig | None = None):
+        self.config = config or UpstreamConfig()
+        self.rand = Random(self.config.seed)
+        self.records = synthetic.raw_records(rows=self.config.rows, agents=self.config.agents, seed=self.config.seed)
+        names = synthetic.business_names(self.config.agents, Random(self.config.seed))
+        self.agents = [{'id': 10000 + i, 'businessName': name, 'mobileNumber': str(2348000000000 + i)} for i, name in enumerate(names)]
+        self.selections = LRU(maxsize=64)
+        self.tokens: dict[str, float] = {}
+        self.stats = UpstreamStats()
+        self.routes = {
+            ("POST", "/auth/tokens"): self.login,
+            ("GET", "/profiles/aggregators"): self.profile,
+            ("GET", "/agents"): self.list_agents,
+            ("GET", "/aggregators/consolidated-transactions/"): self.transactions,
+        }
+
+    def reset(self):
+        """Forget issued tokens and counters, the dataset is kept"""
+        self.tokens.clear()
+        self.stats = UpstreamStats()
+
+    def transport(self) -> MockTransport:
+        return MockTransport(self.handle)
+
+    async def handle(self, request: Request) -> Response:
+        self.stats.requests += 1
+        self.stats.endpoints[request.url.path] += 1
+        self.stats.in_flight += 1
+        self.stats.peak_in_flight = max(self.stats.peak_in_flight, self.stats.in_flight)
+        try:
+            response = await self.respond(request)
+        finally:
+            self.stats.in_flight -= 1
+        self.stats.statuses[response.status_code] += 1
+        return response
+
+    async def respond(self, request: Request) -> Response:
+        config = self.config
+        if config.max_in_flight and self.stats.in_flight > config.max_in_flight:
+            return self.throttled()
+
+        await asyncio.sleep(config.latency + self.rand.uniform(0, config.jitter)) if config.latency or config.jitter else ...
+        if (roll := self.rand.random()) < config.throttle_rate:
+            return self.throttled()
+        if roll < config.throttle_rate + config.error_rate:
+            return Response(500, json={'responseCode': "99", 'responseMessage': "Internal server error"})
+
+        if (route := self.routes.get((request.method, request.url.path))) is None:
+            return Response(404, json={'responseCode': "404", 'responseMessage': "Not found"})
+        if request.url.path != "/auth/tokens" and not self.authorized(request):
+            return Response(401, json={'responseCode': "401", 'responseMessage': "Unauthorized"})
+        return Response(200, json=route(request))
+
+    def throttled(self) -> Response:
+        headers = {'Retry-After': str(self.config.retry_after)} if self.config.retry_after else {}
+        return Response(429, headers=headers, json={'responseCode': "429", 'responseMessage': "Too many requests"})
+
+    def authorized(self, request: Request) -> bool:
+        token = request.headers.get('authorization', "").removeprefix("Bearer ")
+        return self.tokens.get(token, 0) > time.time()
+
+    def login(self, request: Request) -> dict:
+        data = json.loads(request.content or b"{}")
+        if self.config.password is not None and data.get('password') != self.config.password:
+            return {'responseCode': "invalid_grant", 'responseMessage': "Bad credentials"}
+        token = uuid4().hex
+        self.tokens[token] = time.time() + self.config.token_ttl
+        return {'responseCode': "20000", 'tokenData': {'access_token': token, 'expires_in': self.config.token_ttl}}
+
+    def profile(self, request: Request) -> dict:
+        return {'responseCode': "20000", 'profile': {'firstName': "ada", 'lastName': "obi", 'mobileNumber': "2348000000000"}}
+
+    def list_agents(self, request: Request) -> dict:
+        return self.page(self.agents, request, key='agents')
+
+    def transactions(self, request: Request) -> dict:
+        params = request.url.params
+        key = (params.get('startDate', ""), params.get('endDate', ""), params.get('agentId', ""))
+        if (selection := self.selections.get(key)) is None:
+            start, end, agent = key
+            agent = int(agent) if agent.isdigit() else 0
+            selection = [record for record in self.records if (not start or record['createdOn'][:10] >= start)
+                         and (not end or record['createdOn'][:10] <= end) and (not agent or record['agent']['id'] == agent)]
+            self.selections.put(key, selection)
+        return self.page(selection, request, key='consolidatedTransactions')
+
+    @staticmethod
+    def page(items: list, request: Request, *, key: str) -> dict:
+        size = max(1, int(request.url.params.get('pageSize') or 1000))
+        number = max(1, int(request.url.params.get('pageNumber') or 1))
+        return {'responseCode': "20000", 'totalPages': max(1, ceil(len(items) / size)), key: items[(number - 1) * size: number * size]}
+
+    async def __call__(self, scope, receive, send):
+        """ASGI entry point, so the same fake can be served by uvicorn"""
+        if scope['type'] == 'lifespan':
+            while (message := await receive())['type'] != 'lifespan.shutdown':
+                await send({'type': 'lifespan.startup.complete'})
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+        body, more = b"", True
+        while more:
+            message = await receive()
+            body += message.get('body', b"")
+            more = message.get('more_body', False)
+        headers = [(key.decode('latin-1'), value.decode('latin-1')) for key, value in scope['headers']]
+        query = scope.get('query_string', b"").decode()
+        request = Request(scope['method'], f"http://upstream{scope['path']}{'?' + query if query else ''}", headers=headers, content=body)
+        response = await self.handle(request)
+        await send({'type': 'http.response.start', 'status': response.status_code,
+                    'headers': [(key.encode('latin-1'), value.encode('latin-1')) for key, value in response.headers.items()]})
+        await send({'type': 'http.response.body', 'body': response.content})
+
+
+def create_app() -> FakeUpstream:
+    return FakeUpstream(UpstreamConfig.from_env())
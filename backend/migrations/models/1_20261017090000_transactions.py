@@ -0,0 +1,34 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS `transactions` (
+    `id` BIGINT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `agent_id` INT NOT NULL,
+    `business_name` VARCHAR(255) NOT NULL,
+    `trans_type` VARCHAR(63) NOT NULL,
+    `amount` BIGINT NOT NULL  DEFAULT 0,
+    `time` DATETIME(6) NOT NULL,
+    `day` DATE NOT NULL,
+    `aggregator_id` VARCHAR(255) NOT NULL,
+    CONSTRAINT `fk_transact_aggregat_5b1c7a2e` FOREIGN KEY (`aggregator_id`) REFERENCES `aggregators` (`username`) ON DELETE CASCADE,
+    KEY `idx_transaction_aggrega_1f0a3c` (`aggregator_id`, `day`),
+    KEY `idx_transaction_aggrega_8e2d41` (`aggregator_id`, `agent_id`, `day`)
+) CHARACTER SET utf8mb4;
+        CREATE TABLE IF NOT EXISTS `sync_windows` (
+    `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `day` DATE NOT NULL,
+    `complete` BOOL NOT NULL  DEFAULT 0,
+    `records` INT NOT NULL  DEFAULT 0,
+    `synced_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    `aggregator_id` VARCHAR(255) NOT NULL,
+    UNIQUE KEY `uid_sync_window_aggrega_4c9e07` (`aggregator_id`, `day`),
+    CONSTRAINT `fk_sync_win_aggregat_0d6f3b91` FOREIGN KEY (`aggregator_id`) REFERENCES `aggregators` (`username`) ON DELETE CASCADE
+) CHARACTER SET utf8mb4;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS `transactions`;
+        DROP TABLE IF EXISTS `sync_windows`;"""
@@ -0,0 +1,15 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `reports` ADD `digest` VARCHAR(64);
+        ALTER TABLE `reports` ADD `size` INT NOT NULL  DEFAULT 0;
+        ALTER TABLE `reports` ADD INDEX `idx_reports_digest_a4b0c2` (`digest`);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `reports` DROP INDEX `idx_reports_digest_a4b0c2`;
+        ALTER TABLE `reports` DROP COLUMN `digest`;
+        ALTER TABLE `reports` DROP COLUMN `size`;"""
@@ -0,0 +1,27 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `sync_windows` ADD `rolled_up` BOOL NOT NULL  DEFAULT 0;
+        CREATE TABLE IF NOT EXISTS `daily_rollups` (
+    `id` BIGINT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `day` DATE NOT NULL,
+    `agent_id` INT NOT NULL,
+    `business_name` VARCHAR(255) NOT NULL,
+    `trans_type` VARCHAR(63) NOT NULL,
+    `count` INT NOT NULL  DEFAULT 0,
+    `amount` BIGINT NOT NULL  DEFAULT 0,
+    `first_time` DATETIME(6) NOT NULL,
+    `last_time` DATETIME(6) NOT NULL,
+    `aggregator_id` VARCHAR(255) NOT NULL,
+    UNIQUE KEY `uid_daily_rollu_aggrega_7d2e51` (`aggregator_id`, `day`, `agent_id`, `trans_type`),
+    CONSTRAINT `fk_daily_ro_aggregat_3f8a6c0d` FOREIGN KEY (`aggregator_id`) REFERENCES `aggregators` (`username`) ON DELETE CASCADE,
+    KEY `idx_daily_rollu_aggrega_c51b93` (`aggregator_id`, `agent_id`, `day`)
+) CHARACTER SET utf8mb4;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `sync_windows` DROP COLUMN `rolled_up`;
+        DROP TABLE IF EXISTS `daily_rollups`;"""
@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `agents` ADD INDEX `idx_agents_aggrega_ae2a32` (`aggregator_id`, `agent_id`);
+        ALTER TABLE `reports` ADD INDEX `idx_reports_aggrega_9b64df` (`aggregator_id`, `date`);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `agents` DROP INDEX `idx_agents_aggrega_ae2a32`;
+        ALTER TABLE `reports` DROP INDEX `idx_reports_aggrega_9b64df`;"""
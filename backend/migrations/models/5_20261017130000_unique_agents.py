@@ -0,0 +1,14 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DELETE `a` FROM `agents` `a` JOIN `agents` `b` ON `a`.`aggregator_id` = `b`.`aggregator_id` AND `a`.`agent_id` = `b`.`agent_id` AND `a`.`id` > `b`.`id`;
+        ALTER TABLE `agents` DROP INDEX `idx_agents_aggrega_ae2a32`;
+        ALTER TABLE `agents` ADD UNIQUE INDEX `uid_agents_aggrega_ae2a32` (`aggregator_id`, `agent_id`);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `agents` DROP INDEX `uid_agents_aggrega_ae2a32`;
+        ALTER TABLE `agents` ADD INDEX `idx_agents_aggrega_ae2a32` (`aggregator_id`, `agent_id`);"""
@@ -0,0 +1,37 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS `report_runs` (
+    `id` BIGINT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `started_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6),
+    `status` VARCHAR(15) NOT NULL,
+    `wall` DOUBLE NOT NULL  DEFAULT 0,
+    `cpu` DOUBLE NOT NULL  DEFAULT 0,
+    `row_count` INT NOT NULL  DEFAULT 0,
+    `record_count` INT NOT NULL  DEFAULT 0,
+    `page_count` INT NOT NULL  DEFAULT 0,
+    `pdf_size` INT NOT NULL  DEFAULT 0,
+    `aggregator_id` VARCHAR(255) NOT NULL,
+    `report_id` VARCHAR(255),
+    CONSTRAINT `fk_report_r_aggregat_9892dcd9` FOREIGN KEY (`aggregator_id`) REFERENCES `aggregators` (`username`) ON DELETE CASCADE,
+    CONSTRAINT `fk_report_r_reports_7e265813` FOREIGN KEY (`report_id`) REFERENCES `reports` (`name`) ON DELETE SET NULL,
+    KEY `idx_report_runs_aggrega_c28646` (`aggregator_id`, `started_at`)
+) CHARACTER SET utf8mb4;
+        CREATE TABLE IF NOT EXISTS `report_stages` (
+    `id` BIGINT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `stage` VARCHAR(31) NOT NULL,
+    `wall` DOUBLE NOT NULL  DEFAULT 0,
+    `cpu` DOUBLE NOT NULL  DEFAULT 0,
+    `calls` INT NOT NULL  DEFAULT 0,
+    `run_id` BIGINT NOT NULL,
+    UNIQUE KEY `uid_report_stag_run_id_de7c90` (`run_id`, `stage`),
+    CONSTRAINT `fk_report_s_report_r_297095b0` FOREIGN KEY (`run_id`) REFERENCES `report_runs` (`id`) ON DELETE CASCADE
+) CHARACTER SET utf8mb4;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS `report_stages`;
+        DROP TABLE IF EXISTS `report_runs`;"""
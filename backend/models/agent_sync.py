@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+from uuid import uuid4
+from logging import getLogger
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from utils.data_models import Agent
+
+from .tables_orm import AggregatorORM, AgentORM
+
+logger = getLogger()
+
+
+@dataclass
+class SyncCounts:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    def __add__(self, other: 'SyncCounts') -> 'SyncCounts':
+        return SyncCounts(inserted=self.inserted + other.inserted, updated=self.updated + other.updated,
+                          unchanged=self.unchanged + other.unchanged)
+
+
+class AgentSync:
+    """Upsert an aggregator's agents, chunk by chunk, against the unique (aggregator_id, agent_id) index.
+
+    Each chunk costs two statements: a count of the agent_ids that already exist and a multi row insert that updates the name
+    and mobile of the existing ones. The affected row count of the insert then tells inserted, updated and unchanged rows apart:
+    MySQL counts 1 per inserted row, 2 per updated row and 0 per unchanged row, SQLite counts 1 per written row.
+    """
+
+    def __init__(self, *, aggregator: AggregatorORM, conn: BaseDBAsyncClient, chunk_size: int = 1000):
+        self.aggregator = aggregator
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.table = AgentORM._meta.db_table
+        self.mysql = conn.capabilities.dialect == 'mysql'
+
+    def statement(self, size: int) -> str:
+        placeholder = '%s' if self.mysql else '?'
+        row = f"({', '.join([placeholder] * 5)})"
+        insert = f"INSERT INTO `{self.table}` (`id`, `agent_id`, `name`, `mobile`, `aggregator_id`) VALUES {', '.join([row] * size)}"
+        if self.mysql:
+            return f"{insert} ON DUPLICATE KEY UPDATE `name` = VALUES(`name`), `mobile` = VALUES(`mobile`)"
+        return f"{insert} ON CONFLICT (`aggregator_id`, `agent_id`) DO UPDATE SET `name` = excluded.`name`, `mobile` = excluded.`mobile` " \
+               f"WHERE `name` != excluded.`name` OR `mobile` != excluded.`mobile`"
+
+    def counts(self, *, size: int, existing: int, affected: int) -> SyncCounts:
+        inserted = size - existing
+        updated = (affected - inserted) // 2 if self.mysql else affected - inserted
+        return SyncCounts(inserted=inserted, updated=updated, unchanged=existing - updated)
+
+    async def upsert(self, agents: list[Agent]) -> SyncCounts:
+        existing = await AgentORM.filter(aggregator=self.aggregator, agent_id__in=[agent.agent_id for agent in agents]).using_db(self.conn).count()
+        values = [value for agent in agents for value in (str(uuid4()), agent.agent_id, agent.name, agent.mobile, self.aggregator.pk)]
+        affected, _ = await self.conn.execute_query(self.statement(len(agents)), values)
+        return self.counts(size=len(agents), existing=existing, affected=affected)
+
+    async def sync(self, agents: list[Agent]) -> SyncCounts:
+        agents = list({agent.agent_id: agent for agent in agents}.values())
+        counts = SyncCounts()
+        for i in range(0, len(agents), self.chunk_size):
+            counts += await self.upsert(agents[i: i + self.chunk_size])
+        logger.info(f"Synced {len(agents)} agents for {self.aggregator.pk}: {counts}")
+        return counts
@@ -1,32 +1,43 @@
 import datetime
-from typing import Optional, List
-from functools import cache
+from typing import Optional, List, ClassVar
 import logging
 from random import randint
 
 from tortoise.transactions import in_transaction
-from passlib.context import CryptContext
-from pydantic import BaseModel, EmailStr, Field, validator, AnyUrl
+from pydantic import BaseModel, EmailStr, Field, validator, AnyUrl, PrivateAttr
 
 from utils.client import ClientTransaction, Auth, Agent
 from utils.data_models import AgentFilter
+from utils.batch import SummaryAccumulator
 from utils.cloud_upload import S3
 from utils.email import ReportEmail
+from utils.env import env
+from utils.ttl_cache import TTLCache
+from utils.timings import ReportTimings, stage
 
-from .tables_orm import AggregatorORM, AgentORM, ReportORM
+from .tables_orm import AggregatorORM, AgentORM, ReportORM, ReportRunORM, ReportStageORM
 from .transaction import Transactions
+from .warehouse import TransactionWarehouse
+from .agent_sync import AgentSync, SyncCounts
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
+profiles = TTLCache(prefix="moniewatch:aggregator:", ttl=float(env.PROFILE_CACHE_TTL or 300), local_ttl=float(env.PROFILE_CACHE_LOCAL_TTL or 30))
 logger = logging.getLogger()
 
 
 class Aggregator(BaseModel):
+    """An aggregator's profile, `password` is their upstream password.
+
+    The password is never cached or queued, so it is empty on profiles from `resolve` and on task arguments until
+    `credentials` loads it from the database.
+    """
     username: str
-    password: str
+    password: str = ""
     email: EmailStr
     mobile: Optional[int]
     reports: Optional[List[AnyUrl]] = []
     name: Optional[str] = ""
+    _session: ClientTransaction | None = PrivateAttr(default=None)
+    profile_fields: ClassVar[tuple[str, ...]] = ('username', 'email', 'mobile', 'name')
 
     class Config:
         orm_mode = True
@@ -41,10 +52,30 @@ class Aggregator(BaseModel):
         orm = await AggregatorORM.get(username=self.username)
         return orm
 
+    @classmethod
+    async def resolve(cls, username: str) -> 'Aggregator':
+        """The aggregator's profile from the profile cache, loaded from the database on a miss"""
+        if (data := await profiles.get(username)) is None:
+            orm = await AggregatorORM.get(username=username)
+            data = {field: getattr(orm, field) for field in cls.profile_fields}
+            await profiles.set(username, data)
+        return cls(**data)
+
+    async def invalidate(self):
+        await profiles.delete(self.username)
+
+    async def credentials(self) -> 'Aggregator':
+        """Load the upstream password from the database when this profile does not carry it"""
+        if not self.password:
+            self.password = await AggregatorORM.get(username=self.username).values_list('password', flat=True)
+            self.session.auth.password = self.password
+        return self
+
     @property
-    @cache
     def session(self) -> ClientTransaction:
-        return ClientTransaction(auth=Auth(username=self.username, password=self.password))
+        if self._session is None:
+            self._session = ClientTransaction(auth=Auth(username=self.username, password=self.password))
+        return self._session
 
     @property
     async def agents(self):
@@ -54,16 +85,18 @@ class Aggregator(BaseModel):
 
     async def init(self):
         try:
-            async with in_transaction():
+            await self.credentials()
+            async with in_transaction() as conn:
                 await self.session.authenticate()
                 agents = await self.session.get_agents()
                 aggregator = await self.orm
                 profile = await self.session.profile()
-                await AgentORM.bulk_create(objects=[AgentORM(**agent.dict(), aggregator=aggregator) for agent in agents])
-                await aggregator.update_from_dict(**profile.dict)
+                await AgentSync(aggregator=aggregator, conn=conn).sync(agents)
+                await aggregator.update_from_dict(profile.dict)
                 await aggregator.save(update_fields=tuple(profile.dict.keys()))
-                await self.session.close()
-                return True
+            await self.invalidate()
+            await self.session.close()
+            return True
         except Exception as ex:
             logging.critical(ex, "Unable to get agents")
             await self.session.close()
@@ -72,38 +105,53 @@ class Aggregator(BaseModel):
         orm = await self.orm
         await orm.update_from_dict(kwargs)
         await orm.save(update_fields=tuple(kwargs.keys()))
+        await self.invalidate()
 
-    def verify_password(*, plain_password: str, hashed_password: str) -> bool:
-        return pwd_context.verify(plain_password, hashed_password)
-
-    async def update_agents(self):
-        sess = self.session
-        await self.session.authenticate()
-        api_agents = {Agent(**agent.dict()) for agent in await sess.get_agents()}
-        db_agents = await self.agents
-        new_agents = api_agents - {*db_agents}
-        aggregator = await self.orm
-        await AgentORM.bulk_create(objects=[AgentORM(**agent.dict(), aggregator=aggregator) for agent in new_agents])
-        await self.session.close()
+    async def update_agents(self) -> SyncCounts | None:
+        """Insert new agents and refresh the name and mobile of known ones"""
+        try:
+            await self.credentials()
+            await self.session.authenticate()
+            agents = await self.session.get_agents()
+            async with in_transaction() as conn:
+                counts = await AgentSync(aggregator=await self.orm, conn=conn).sync(agents)
+            await self.invalidate()
+            return counts
+        except Exception as err:
+            logger.critical(f"{err}: Unable to update agents")
+        finally:
+            await self.session.close()
 
     async def get_transactions(self, *, start_date: datetime.date | None = None, end_date: datetime.date | None = None, target: float | None,
                                agents: List[Agent] | None = None, title: str = "") -> Transactions | None:
         try:
+            await self.credentials()
             today = datetime.date.today()
             start_date = start_date or today
             end_date = end_date or today
             title = title or f"Transactions Report for {self.name} {start_date.strftime('%A, %B %d %Y')} {randint(10, 1010)}"
-            if await self.session.authenticate():
-                transactions = await self.session.get_consolidated_transactions(start_date=start_date, end_date=end_date)
+            agents = agents or await self.agents
+            agent_ids = [agent.agent_id for agent in agents]
+            accumulator = SummaryAccumulator(filter=AgentFilter(agents=agent_ids) if agent_ids else None)
+            warehouse = TransactionWarehouse(aggregator=await self.orm, session=self.session)
+            if await warehouse.summarize(start_date=start_date, end_date=end_date, accumulator=accumulator, agents=agent_ids):
                 await self.session.close()
-                agents = agents or await self.agents
-                filter = AgentFilter(agents=[agent.agent_id for agent in agents])
-                transactions = Transactions(title=title, transactions=transactions, agents=agents, filter=filter, target=target or 50000)
-                return transactions
+                return Transactions(title=title, summary=accumulator.result(), agents=agents, target=target or 50000)
+            await self.session.close()
         except Exception as err:
             logger.critical(f"{err}: Unable to generate transactions")
             await self.session.close()
 
+    async def close_days(self, *, start_date: datetime.date, end_date: datetime.date):
+        """Sync recently closed days so that they are marked complete and rolled up, then roll up any day left behind"""
+        try:
+            await self.credentials()
+            warehouse = TransactionWarehouse(aggregator=await self.orm, session=self.session)
+            await warehouse.sync(start_date=start_date, end_date=end_date)
+            await warehouse.roll_up_pending()
+        except Exception as err:
+            logger.critical(f"{err}: Unable to close days")
+
     async def get_pdf(self, *, transactions: Transactions):
         return await transactions.get_pdf()
 
@@ -118,14 +166,48 @@ class Aggregator(BaseModel):
         except Exception as err:
             logger.critical(f"{err}: Unable to upload file to cloud")
 
-    async def save_report(self, *, url: str, name: str) -> ReportORM:
+    async def save_report(self, *, url: str, name: str, digest: str | None = None, size: int = 0) -> ReportORM:
         try:
-            agg = await self.orm
-            rep = await ReportORM.create(name=name, url=url, aggregator=agg)
+            with stage("save"):
+                rep = await ReportORM.create(name=name, url=url, aggregator_id=self.username, digest=digest, size=size)
             return rep
         except Exception as err:
             logger.critical(f"{err}: unable to save report")
 
+    async def save_run(self, *, timings: ReportTimings, status: str, report: ReportORM | None = None) -> ReportRunORM | None:
+        try:
+            async with in_transaction() as conn:
+                run = await ReportRunORM.create(status=status, wall=timings.wall, cpu=timings.cpu, row_count=timings.counts.get('rows', 0),
+                                                record_count=timings.counts.get('records', 0), page_count=timings.counts.get('pages', 0),
+                                                pdf_size=timings.counts.get('pdf_bytes', 0), report=report, aggregator_id=self.username,
+                                                using_db=conn)
+                stages = [ReportStageORM(stage=name, wall=timing.wall, cpu=timing.cpu, calls=timing.calls, run=run)
+                          for name, timing in timings.stages.items()]
+                await ReportStageORM.bulk_create(stages, using_db=conn)
+            return run
+        except Exception as err:
+            logger.warning(f"{err}: unable to save report run")
+
+    async def cached_report(self, *, digest: str) -> ReportORM | None:
+        try:
+            return await ReportORM.filter(aggregator_id=self.username, digest=digest).order_by('-date').first()
+        except Exception as err:
+            logger.warning(f"{err}: unable to look up cached report")
+
+    async def evict_reports(self, *, max_age: datetime.timedelta | None = None):
+        """Stop serving reports older than REPORT_CACHE_DAYS from the cache.
+
+        Eviction is by age only. Cached reports are the aggregator's own reports, listed and emailed to them, so evicting one only
+        clears its digest, the PDF and its row are kept. Evicting by size would free nothing and make the next identical request
+        render and upload another copy.
+        """
+        try:
+            max_age = max_age or datetime.timedelta(days=int(env.REPORT_CACHE_DAYS or 30))
+            cutoff = datetime.datetime.now() - max_age
+            await ReportORM.filter(aggregator_id=self.username, digest__not_isnull=True, date__lt=cutoff).update(digest=None)
+        except Exception as err:
+            logger.warning(f"{err}: unable to evict cached reports")
+
     async def send_report(self, *, url):
         try:
             mail = ReportEmail(name=self.name, link=url, recipients=[self.email])
@@ -150,9 +232,6 @@ class CreateAggregator(BaseModel):
             raise ValueError('Password Mismatch')
         return v
 
-    def password_hash(self):
-        return pwd_context.hash(self.password)
-
     class Config:
         allow_population_by_field_name = True
         fields = {'confirm_password': {"exclude": True}}
@@ -10,6 +10,10 @@ class AggregatorORM(Model):
     mobile = fields.BigIntField(null=True)
     agents: fields.ReverseRelation['AgentORM']
     reports: fields.ReverseRelation['ReportORM']
+    transactions: fields.ReverseRelation['TransactionORM']
+    sync_windows: fields.ReverseRelation['SyncWindowORM']
+    rollups: fields.ReverseRelation['DailyRollupORM']
+    report_runs: fields.ReverseRelation['ReportRunORM']
 
     class Meta:
         table = "aggregators"
@@ -25,13 +29,101 @@ class AgentORM(Model):
 
     class Meta:
         table = "agents"
+        unique_together = (('aggregator', 'agent_id'),)
 
 
 class ReportORM(Model):
     name = fields.CharField(max_length=255, pk=True)
     date = fields.DatetimeField(auto_now_add=True)
     url = fields.CharField(max_length=511, unique=True)
+    digest = fields.CharField(max_length=64, null=True, index=True)
+    size = fields.IntField(default=0)
     aggregator: fields.ForeignKeyRelation = fields.ForeignKeyField('models.AggregatorORM', related_name='reports', on_delete="CASCADE")
+    runs: fields.ReverseRelation['ReportRunORM']
 
     class Meta:
         table = "reports"
+        indexes = (('aggregator', 'date'),)
+
+
+class TransactionORM(Model):
+    id = fields.BigIntField(pk=True)
+    agent_id = fields.IntField()
+    business_name = fields.CharField(max_length=255)
+    trans_type = fields.CharField(max_length=63)
+    amount = fields.BigIntField(default=0)
+    time = fields.DatetimeField()
+    day = fields.DateField()
+    aggregator: fields.ForeignKeyRelation = fields.ForeignKeyField('models.AggregatorORM', related_name='transactions', on_delete="CASCADE")
+
+    class Meta:
+        table = "transactions"
+        indexes = (('aggregator', 'day'), ('aggregator', 'agent_id', 'day'))
+
+
+class SyncWindowORM(Model):
+    """A day of upstream transactions already copied into the transactions table"""
+    id = fields.IntField(pk=True)
+    day = fields.DateField()
+    complete = fields.BooleanField(default=False)
+    rolled_up = fields.BooleanField(default=False)
+    records = fields.IntField(default=0)
+    synced_at = fields.DatetimeField(auto_now=True)
+    aggregator: fields.ForeignKeyRelation = fields.ForeignKeyField('models.AggregatorORM', related_name='sync_windows', on_delete="CASCADE")
+
+    class Meta:
+        table = "sync_windows"
+        unique_together = (('aggregator', 'day'),)
+
+
+class DailyRollupORM(Model):
+    """Count and amount of one transaction type for one agent on one closed day"""
+    id = fields.BigIntField(pk=True)
+    day = fields.DateField()
+    agent_id = fields.IntField()
+    business_name = fields.CharField(max_length=255)
+    trans_type = fields.CharField(max_length=63)
+    count = fields.IntField(default=0)
+    amount = fields.BigIntField(default=0)
+    first_time = fields.DatetimeField()
+    last_time = fields.DatetimeField()
+    aggregator: fields.ForeignKeyRelation = fields.ForeignKeyField('models.AggregatorORM', related_name='rollups', on_delete="CASCADE")
+
+    class Meta:
+        table = "daily_rollups"
+        unique_together = (('aggregator', 'day', 'agent_id', 'trans_type'),)
+        indexes = (('aggregator', 'agent_id', 'day'),)
+
+
+class ReportRunORM(Model):
+    """One run of the report pipeline, cache hits and failures included"""
+    id = fields.BigIntField(pk=True)
+    started_at = fields.DatetimeField(auto_now_add=True)
+    status = fields.CharField(max_length=15)
+    wall = fields.FloatField(default=0)
+    cpu = fields.FloatField(default=0)
+    row_count = fields.IntField(default=0)
+    record_count = fields.IntField(default=0)
+    page_count = fields.IntField(default=0)
+    pdf_size = fields.IntField(default=0)
+    report: fields.ForeignKeyNullableRelation = fields.ForeignKeyField('models.ReportORM', related_name='runs', null=True, on_delete="SET NULL")
+    aggregator: fields.ForeignKeyRelation = fields.ForeignKeyField('models.AggregatorORM', related_name='report_runs', on_delete="CASCADE")
+    stages: fields.ReverseRelation['ReportStageORM']
+
+    class Meta:
+        table = "report_runs"
+        indexes = (('aggregator', 'started_at'),)
+
+
+class ReportStageORM(Model):
+    """Wall clock and CPU seconds a report run spent in one stage, summed over the calls made in that stage"""
+    id = fields.BigIntField(pk=True)
+    stage = fields.CharField(max_length=31)
+    wall = fields.FloatField(default=0)
+    cpu = fields.FloatField(default=0)
+    calls = fields.IntField(default=0)
+    run: fields.ForeignKeyRelation = fields.ForeignKeyField('models.ReportRunORM', related_name='stages', on_delete="CASCADE")
+
+    class Meta:
+        table = "report_stages"
+        unique_together = (('run', 'stage'),)
@@ -1,12 +1,24 @@
 import asyncio
-from functools import cache
-from typing import Iterable
-from pathlib import Path
-from pydantic import BaseModel
+import time
+import json
+from hashlib import sha256
+from io import BytesIO
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from types import MappingProxyType
+from typing import Iterable, BinaryIO, ClassVar, Mapping
+import numpy as np
+from pydantic import BaseModel, PrivateAttr
 from logging import getLogger
 
 from utils.env import env
 from utils.data_models import Transaction, Agent, Filter
+from utils.batch import TransactionBatch, AgentSummaries
+from utils.memo import lazy, invalidate
+from utils.loop import run_cpu
+from utils import timings
 from utils.pdf import BaseDocTemplate, dx, dy, px, py, PageTemplate, ParagraphStyle, DocBuilder, Frame, colors, TableStyle
 
 
@@ -14,66 +26,132 @@ logger = getLogger()
 
 
 class BusinessSummary(BaseModel):
+    agent_id: int
     business_name: str
     amount: float
 
     class Config:
         extra = "allow"
+        frozen = True
 
 
 class Transactions(BaseModel):
+    """Per agent views of a set of transactions or of an already computed summary.
+
+    Views are computed on first access and kept on the instance, assigning a field drops the views that depend on it.
+    pydantic stores `transactions` as an iterator, so the batch can only be rebuilt when a new iterable is assigned.
+    The views that only depend on the summary are shared, through a small LRU, by instances with identical summaries, so they
+    are read only: a mapping proxy of frozen BusinessSummary rows and a tuple.
+    """
     title: str
-    transactions: Iterable[Transaction]
+    transactions: Iterable[Transaction] = ()
     target: float
     agents: list[Agent] = []
     filter: Filter = Filter()
+    summary: AgentSummaries | None = None
+    _memo: dict = PrivateAttr(default_factory=dict)
+    views: ClassVar[dict[str, tuple]] = {'title': (), 'target': ('below_target',), 'agents': ('inactive',)}
 
     class Config:
         arbitrary_types_allowed = True
-
-    def __hash__(self):
-        return hash(self.title)
+        keep_untouched = (lazy,)
 
     def __iter__(self) -> Iterable[Transaction]:
-        return self.transactions
-
-    @property
-    @cache
-    def data(self) -> dict['str', BusinessSummary]:
-        data_ = {}
-        for trans in self:
-            if not self.filter(trans=trans):
-                continue
-            key = trans.agent_id
-            bus = data_.setdefault(key, {})
-            if bus.get('business_name', None) is None:
-                bus['business_name'] = trans.business_name
-            bus['amount'] = (bus.get('amount') or 0) + trans.amount / 100
-            bus[trans.trans_type] = (bus.get(trans.trans_type) or 0) + 1
-        return {value['business_name']: BusinessSummary(**value) for key, value in data_.items()}
-
-    @property
-    @cache
-    def sort_data(self) -> list:
-        return sorted(self.data.keys(), reverse=True, key=lambda key: self.data[key].amount)
-
-    def get_below_target_agents(self, target: float = 0) -> dict[str, BusinessSummary]:
-        return {key: value for key, value in self.data.items() if value.amount < (target or self.target)}
+        return iter(self.transactions)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self.views:
+            self.invalidate(*self.views[name]) if self.views[name] else ...
+        elif name in self.__fields__:
+            self.invalidate()
+
+    def invalidate(self, *names: str):
+        invalidate(self, *names)
+
+    def memo_key(self) -> str:
+        return self.fingerprint
+
+    @lazy
+    def batch(self) -> TransactionBatch:
+        batch = TransactionBatch.from_transactions(self)
+        return batch.select(self.filter.mask(batch))
+
+    @lazy
+    def summaries(self) -> AgentSummaries:
+        return self.summary if self.summary is not None else self.batch.summarize()
+
+    @lazy
+    def fingerprint(self) -> str:
+        """Hash of the summaries that ignores row and column order, cheap next to building the views from them"""
+        summaries = self.summaries
+        rows = np.argsort(summaries.agent_id, kind='stable')
+        columns = np.argsort(summaries.types, kind='stable')
+        digest = sha256()
+        for array in (summaries.agent_id[rows], summaries.amount[rows], summaries.counts[np.ix_(rows, columns)]):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(json.dumps([sorted(summaries.types), sorted(summaries.names.items())]).encode())
+        return digest.hexdigest()
+
+    @lazy(shared=True)
+    def data(self) -> Mapping[int, BusinessSummary]:
+        return MappingProxyType({row['agent_id']: BusinessSummary(**row) for row in self.summaries.rows()})
+
+    @lazy(shared=True)
+    def sort_data(self) -> tuple[int, ...]:
+        return tuple(self.summaries.ranking().tolist())
+
+    @lazy
+    def below_target(self) -> list[int]:
+        return self.summaries.below(self.target).tolist()
+
+    @lazy
+    def inactive(self) -> list[Agent]:
+        """Agents without a transaction"""
+        return [agent for agent in self.agents if agent.agent_id not in self.data]
+
+    def get_below_target_agents(self, target: float = 0) -> dict[int, BusinessSummary]:
+        keys = self.summaries.below(target).tolist() if target else self.below_target
+        return {key: self.data[key] for key in keys}
 
     def table_data(self):
-        keys = self.sort_data
-        data = [[key, self.data[key].amount] for key in keys]
+        data = [[self.data[key].business_name, self.data[key].amount] for key in self.sort_data]
         data.insert(0, ['Business Name', "Amount"])
         return data
 
     def get_non_performing_agents(self):
-        data = [[agent.name] for agent in self.agents if agent.name not in self.data.keys()]
+        data = [[agent.name] for agent in self.inactive]
         data.insert(0, ["Business Name"])
         return data
 
-    async def get_pdf(self) -> Path | None:
-        report = TransactionsReport(transactions=self)
-        return await report.create()
+    def digest(self, **params) -> str:
+        """Stable hash of everything that ends up in the report, the random title excluded"""
+        rows = sorted(self.summaries.rows(), key=lambda row: row['agent_id'])
+        agents = sorted((agent.agent_id, agent.name) for agent in self.agents)
+        data = {'params': params, 'target': self.target, 'agents': agents, 'summaries': rows}
+        return sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def report_content(self) -> 'ReportContent':
+        below_target = [value.dict() for value in self.get_below_target_agents().values()]
+        return ReportContent(title=self.title, table=self.table_data(), below_target=below_target, inactive=self.get_non_performing_agents())
+
+    async def get_pdf(self) -> BytesIO | None:
+        try:
+            file = BytesIO(await renderer.render(await run_cpu(self.report_content)))
+            file.name = f"{self.title}.pdf"
+            return file
+        except Exception as err:
+            logger.critical(f"{err}: Unable to create pdf report.")
+
+
+@dataclass
+class ReportContent:
+    """Everything a report shows, as plain python values so that it can be shipped to a render process"""
+    title: str
+    table: list[list]
+    below_target: list[dict]
+    inactive: list[list]
+    author: str = ""
 
 
 class TransactionsReport(BaseDocTemplate):
@@ -85,13 +163,13 @@ class TransactionsReport(BaseDocTemplate):
     tabel_styles = TableStyle([("INNERGRID", (0, 0), (-1, -1), 1, colors.black), ("BOX", (0, 0), (-1, -1), 1, colors.black),
                          ("TEXTCOLOR", (1, 0), (1, -1), colors.darkorange), ("TEXTCOLOR", (0, 0), (0, -1), colors.darkgreen)])
 
-    def __init__(self, *, transactions: Transactions, folder="reports", **kwargs):
-        self.transactions = transactions
-        self.file = env.BASE / f"{folder}/{self.transactions.title}.pdf"
-        super().__init__(filename=str(self.file), leftMargin=dx(21), topMargin=dx(29.7), **kwargs)
+    def __init__(self, *, content: ReportContent, file: BinaryIO | str, **kwargs):
+        self.content = content
+        self.file = file
+        super().__init__(filename=file, leftMargin=dx(21), topMargin=dx(29.7), **kwargs)
 
         self.doc = DocBuilder()
-        self.author = kwargs.get('author') or env.APP_NAME
+        self.author = content.author or kwargs.get('author') or env.APP_NAME or ""
 
         padding = dict(leftPadding=px(5), bottomPadding=px(5), rightPadding=px(5), topPadding=px(5))
         page_template = PageTemplate('normal', [Frame(0, 0, px(100), py(100), **padding, id='F1')], onPageEnd=self.doc.add_page_number)
@@ -108,38 +186,39 @@ class TransactionsReport(BaseDocTemplate):
 
     def write_cover_page(self):
         self.doc.add_space(width=dx(5), height=dy(15))
-        self.doc.add_title(title=self.transactions.title)
+        self.doc.add_title(title=self.content.title)
         self.doc.add_page_break()
 
     def write_table_of_transactions(self):
-        data = self.transactions.table_data()
+        data = self.content.table
         if len(data) <= 1:
             return
         self.doc.add_title(title="Summary of Transactions")
         self.doc.add_table(data=data, styles=self.tabel_styles, repeatRows=1, spaceBefore=py(2))
         self.doc.add_page_break()
 
-    def write_business_data(self, *, data: Iterable[BusinessSummary]):
+    def write_business_data(self, *, data: Iterable[dict]):
         for business in data:
-            details = """<br/>""".join(f"{' '.join(key.split('_')).title()}: {value}" for key, value in business.dict().items()
-                                       if key != 'amount' and key != 'business_name')
+            details = """<br/>""".join(f"{' '.join(key.split('_')).title()}: {value}" for key, value in business.items()
+                                       if key not in ('amount', 'business_name', 'agent_id'))
             card_text = self.card_text_format
-            text = card_text.format(business_name=business.business_name, details=details, amount=f"<strong>Total Amount: {business.amount}</strong>")
+            text = card_text.format(business_name=business['business_name'], details=details,
+                                    amount=f"<strong>Total Amount: {business['amount']}</strong>")
             self.doc.add_paragraph(body=text, style=self.card_style)
             self.doc.add_space(width=dx(3), height=dx(5))
 
     def write_below_target_performers(self):
-        data = self.transactions.get_below_target_agents()
+        data = self.content.below_target
         if len(data) < 1:
             return
         title = "Agents Performing Below Target"
         self.doc.add_title(title=title)
         self.doc.add_space(width=dx(3), height=dx(3))
-        self.write_business_data(data=data.values())
+        self.write_business_data(data=data)
         self.doc.add_page_break()
 
     def write_agents_with_zero_transactions(self):
-        data = self.transactions.get_non_performing_agents()
+        data = self.content.inactive
         if len(data) <= 1:
             return
         title = "Agents With No Transactions"
@@ -154,11 +233,56 @@ class TransactionsReport(BaseDocTemplate):
         self.write_below_target_performers()
         self.write_table_of_transactions()
 
-    async def create(self):
+    def render(self):
+        self.write()
+        self.build(flowables=self.doc.data)
+
+
+def render(content: ReportContent) -> bytes:
+    """Lay out and build a report, runs inside the render process pool"""
+    buffer = BytesIO()
+    TransactionsReport(content=content, file=buffer).render()
+    return buffer.getvalue()
+
+
+def timed_render(content: ReportContent) -> tuple[bytes, float]:
+    """render plus the CPU seconds it took in the render process"""
+    start = time.process_time()
+    pdf = render(content)
+    return pdf, time.process_time() - start
+
+
+class Renderer:
+    """Builds reports in a pool of processes so that concurrent reports are not serialised by the GIL.
+
+    RENDER_PROCESSES sets the pool size (defaults to 1, every web and worker process starts its own pool), 0 renders in the default
+    thread pool instead.
+    """
+
+    def __init__(self, processes: int | None = None):
+        self.processes = processes if processes is not None else int(env.RENDER_PROCESSES or 1)
+        self.executor: ProcessPoolExecutor | None = None
+
+    def get_executor(self) -> ProcessPoolExecutor | None:
+        if self.processes and self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=get_context('spawn'))
+        return self.executor
+
+    async def render(self, content: ReportContent) -> bytes:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
         try:
-            self.write()
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, lambda flowables: self.build(flowables=flowables), self.doc.data)
-            return self.file
-        except Exception as err:
-            logger.critical(f"{err}: Unable to create pdf report.")
+            pdf, cpu = await loop.run_in_executor(self.get_executor(), timed_render, content)
+            timings.record("render", wall=time.perf_counter() - start, cpu=cpu)
+            return pdf
+        except BrokenProcessPool:
+            self.executor = None
+            raise
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+renderer = Renderer()
@@ -0,0 +1,192 @@
+import datetime
+from contextlib import nullcontext
+from itertools import groupby
+from typing import AsyncIterator
+from logging import getLogger
+
+from tortoise.transactions import in_transaction
+from tortoise.functions import Count, Sum, Min, Max
+
+from utils.env import env
+from utils.db import db_time
+from utils.client import ClientTransaction
+from utils.data_models import Transaction
+from utils.loop import run_cpu
+from utils.timings import stage, count
+from utils.batch import TransactionBatch, SummaryAccumulator, AgentSummaries
+
+from .tables_orm import AggregatorORM, TransactionORM, SyncWindowORM, DailyRollupORM
+
+logger = getLogger()
+
+
+class TransactionWarehouse:
+    """Local copy of an aggregator's upstream transactions, synced one day at a time.
+
+    A day is only marked complete once it has been fetched after it closed (plus a settling period for late postings),
+    complete days are never fetched again and are rolled up into per agent, per type daily totals.
+    Days are the upstream's own dates, times are stored in DB_TIMEZONE whatever offset the upstream sent them with.
+    """
+    fields = ('business_name', 'time', 'trans_type', 'agent_id', 'amount')
+
+    def __init__(self, *, aggregator: AggregatorORM, session: ClientTransaction, settle_hours: float | None = None, batch_size: int = 1000):
+        self.aggregator = aggregator
+        self.session = session
+        self.settle = datetime.timedelta(hours=settle_hours if settle_hours is not None else float(env.SYNC_SETTLE_HOURS or 2))
+        self.batch_size = batch_size
+
+    @staticmethod
+    def days(start_date: datetime.date, end_date: datetime.date) -> list[datetime.date]:
+        return [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+    def is_closed(self, day: datetime.date, now: datetime.datetime | None = None) -> bool:
+        now = now or datetime.datetime.now()
+        return now >= datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()) + self.settle
+
+    async def pending_days(self, *, start_date: datetime.date, end_date: datetime.date) -> list[datetime.date]:
+        complete = await SyncWindowORM.filter(aggregator=self.aggregator, day__range=(start_date, end_date), complete=True).values_list('day', flat=True)
+        complete = set(complete)
+        return [day for day in self.days(start_date, end_date) if day not in complete]
+
+    @staticmethod
+    def ranges(days: list[datetime.date]) -> list[tuple[datetime.date, datetime.date]]:
+        """Collapse sorted days into contiguous (start, end) runs so each run is a single upstream query"""
+        runs = groupby(enumerate(days), key=lambda item: item[1] - datetime.timedelta(days=item[0]))
+        ranges = []
+        for _, run in runs:
+            run = [day for _, day in run]
+            ranges.append((run[0], run[-1]))
+        return ranges
+
+    async def sync(self, *, start_date: datetime.date, end_date: datetime.date) -> bool:
+        days = await self.pending_days(start_date=start_date, end_date=end_date)
+        return await self.fetch(days=days)
+
+    async def fetch(self, *, days: list[datetime.date], accumulator: SummaryAccumulator | None = None) -> bool:
+        """Fetch and store the given days, folding the fetched pages into accumulator when one is given"""
+        if not days:
+            return True
+
+        if not await self.session.authenticate():
+            return False
+
+        for start, end in self.ranges(days):
+            if not await self.sync_range(start_date=start, end_date=end, accumulator=accumulator):
+                return False
+        return True
+
+    async def sync_range(self, *, start_date: datetime.date, end_date: datetime.date, accumulator: SummaryAccumulator | None = None) -> bool:
+        """Replace the stored transactions of the range with a fresh copy from upstream.
+
+        Every page is written in a short transaction of its own once it has been fetched, so no lock is held while waiting on
+        upstream. The sync windows are only updated after the last page, a sync that fails part way leaves its days pending
+        and their partial rows are deleted and fetched again on the next sync.
+        """
+        days = self.days(start_date, end_date)
+        records = dict.fromkeys(days, 0)
+        now = datetime.datetime.now()
+        try:
+            await TransactionORM.filter(aggregator=self.aggregator, day__in=days).delete()
+            async for page in self.session.iter_consolidated_transactions(start_date=start_date, end_date=end_date):
+                page = [trans for trans in page if trans.time.date() in records]
+                for trans in page:
+                    records[trans.time.date()] += 1
+                with stage("store"):
+                    objects = [TransactionORM(**{**trans.dict, 'time': db_time(trans.time)}, day=trans.time.date(), aggregator=self.aggregator)
+                               for trans in page]
+                    async with in_transaction() as conn:
+                        await TransactionORM.bulk_create(objects, batch_size=self.batch_size, using_db=conn)
+                if accumulator is not None:
+                    with stage("aggregate"):
+                        accumulator.fold(TransactionBatch.from_transactions(page))
+
+            async with in_transaction() as conn:
+                for day in days:
+                    await SyncWindowORM.update_or_create(aggregator=self.aggregator, day=day, using_db=conn,
+                                                         defaults={'complete': self.is_closed(day, now=now), 'rolled_up': False,
+                                                                   'records': records[day]})
+                await self.roll_up(days=[day for day in days if self.is_closed(day, now=now)], conn=conn)
+            return True
+        except Exception as err:
+            logger.warning(f"{err}: Unable to sync transactions for {self.aggregator.pk} from {start_date} to {end_date}")
+            return False
+
+    async def iter_transactions(self, *, days: list[datetime.date], agents: list[int] | None = None, size: int = 5000) \
+            -> AsyncIterator[list[Transaction]]:
+        """Stored transactions for the given days in keyset paginated chunks of `size` rows"""
+        last = 0
+        while days:
+            query = TransactionORM.filter(aggregator=self.aggregator, day__in=days, id__gt=last)
+            query = query.filter(agent_id__in=agents) if agents else query
+            rows = await query.order_by('id').limit(size).values_list('id', *self.fields)
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [Transaction(*row[1:]) for row in rows]
+
+    async def roll_up(self, *, days: list[datetime.date], conn=None):
+        """Recompute the daily rollups of complete days from the stored transactions"""
+        if not days:
+            return
+        async with in_transaction() if conn is None else nullcontext(conn) as conn:
+            await DailyRollupORM.filter(aggregator=self.aggregator, day__in=days).using_db(conn).delete()
+            rows = await TransactionORM.filter(aggregator=self.aggregator, day__in=days).using_db(conn) \
+                .annotate(total=Count('id'), total_amount=Sum('amount'), first=Min('time'), last=Max('time'), name=Max('business_name')) \
+                .group_by('day', 'agent_id', 'trans_type').values('day', 'agent_id', 'trans_type', 'total', 'total_amount', 'first', 'last', 'name')
+            objects = [DailyRollupORM(day=row['day'], agent_id=row['agent_id'], trans_type=row['trans_type'], count=row['total'],
+                                      amount=int(row['total_amount'] or 0), first_time=row['first'], last_time=row['last'],
+                                      business_name=row['name'], aggregator=self.aggregator) for row in rows]
+            await DailyRollupORM.bulk_create(objects, batch_size=self.batch_size, using_db=conn)
+            await SyncWindowORM.filter(aggregator=self.aggregator, day__in=days).using_db(conn).update(rolled_up=True)
+
+    async def roll_up_pending(self) -> int:
+        """Roll up complete days that have not been rolled up yet, returns the number of days rolled up"""
+        days = await SyncWindowORM.filter(aggregator=self.aggregator, complete=True, rolled_up=False).values_list('day', flat=True)
+        await self.roll_up(days=list(days))
+        return len(days)
+
+    async def rollup_summary(self, *, days: list[datetime.date], agents: list[int] | None = None) -> AgentSummaries:
+        query = DailyRollupORM.filter(aggregator=self.aggregator, day__in=days)
+        query = query.filter(agent_id__in=agents) if agents else query
+        rows = await query.annotate(total=Sum('count'), total_amount=Sum('amount'), first=Min('first_time'), last=Max('last_time'),
+                                    name=Max('business_name')).group_by('agent_id', 'trans_type') \
+            .values('agent_id', 'trans_type', 'total', 'total_amount', 'first', 'last', 'name')
+        return AgentSummaries.from_rows({'agent_id': row['agent_id'], 'trans_type': row['trans_type'], 'count': row['total'],
+                                         'amount': row['total_amount'], 'first_time': row['first'], 'last_time': row['last'],
+                                         'business_name': row['name']} for row in rows)
+
+    async def summarize(self, *, start_date: datetime.date, end_date: datetime.date, accumulator: SummaryAccumulator,
+                        agents: list[int] | None = None, rollups: bool = True) -> bool:
+        """Fold every transaction in the range into accumulator.
+
+        Pending days are folded straight from the upstream pages while they are being stored, rolled up days are summed from the
+        daily rollups in the database and any other stored day is read back in chunks.
+        Rollups only honour the `agents` restriction, pass rollups=False when the accumulator filters on anything else.
+        """
+        pending = await self.pending_days(start_date=start_date, end_date=end_date)
+        if not await self.fetch(days=pending, accumulator=accumulator):
+            return False
+
+        pending = set(pending)
+        rolled = set()
+        if rollups:
+            rolled = await SyncWindowORM.filter(aggregator=self.aggregator, day__range=(start_date, end_date), complete=True, rolled_up=True) \
+                .values_list('day', flat=True)
+            rolled = set(rolled) - pending
+            if rolled:
+                with stage("rollups"):
+                    summary = await self.rollup_summary(days=list(rolled), agents=agents)
+                with stage("aggregate"):
+                    accumulator.merge(summary)
+
+        stored = [day for day in self.days(start_date, end_date) if day not in pending and day not in rolled]
+        async for chunk in self.iter_transactions(days=stored, agents=agents):
+            count("stored_rows", len(chunk))
+            await run_cpu(self.fold, accumulator, chunk)
+        count("rows", accumulator.rows)
+        return True
+
+    @staticmethod
+    def fold(accumulator: SummaryAccumulator, transactions: list[Transaction]):
+        with stage("aggregate"):
+            accumulator.fold(TransactionBatch.from_transactions(transactions))
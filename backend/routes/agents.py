@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+
+from .dependencies import list_agents
+from utils import ResponseModel, error_handler
+
+router = APIRouter(prefix="/api/v1/agents")
+
+
+@router.get('/')
+@error_handler
+async def agents(res: ResponseModel = Depends(list_agents)):
+    return res
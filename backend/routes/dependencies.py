@@ -1,7 +1,10 @@
 from logging import getLogger
 from datetime import datetime, timedelta, date
+from hmac import compare_digest
+from uuid import uuid4
 
-from fastapi import HTTPException, status, Body, Depends
+from fastapi import HTTPException, status, Body, Depends, Query, Header
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, Field
 from jose import JWTError, jwt
@@ -9,8 +12,11 @@ from tortoise.transactions import in_transaction
 from tortoise.exceptions import IntegrityError
 from celery.result import AsyncResult
 
-from models.aggregator import CreateAggregator, Aggregator, AggregatorORM, Agent, AgentORM, Report
+from models.aggregator import CreateAggregator, Aggregator, AggregatorORM, Agent, AgentORM, Report, ReportORM, ReportRunORM
 from utils.env import env
+from utils.pagination import keyset, PAGE_SIZE, MAX_PAGE_SIZE
+from utils.progress import Progress
+from utils.single_flight import report_flights, flight_key
 from utils import error_handler, ResponseModel
 from utils.worker import get_agents, get_report
 
@@ -29,7 +35,7 @@ async def create(aggregator: CreateAggregator) -> ResponseModel:
     async with in_transaction():
         try:
             agg = await AggregatorORM.create(**aggregator.dict())
-            agg = Aggregator(email=agg.email, username=agg.username, password=agg.password)
+            agg = Aggregator(email=agg.email, username=agg.username)
         except IntegrityError as err:
             logger.error(err)
             return ResponseModel(message="A user with this username already exists", status=False)
@@ -37,6 +43,7 @@ async def create(aggregator: CreateAggregator) -> ResponseModel:
             logger.error(err)
             raise err
         else:
+            await agg.invalidate()
             data = agg.dict()
             get_agents.delay(data)
             return ResponseModel(message="User Created Successfully")
@@ -55,44 +62,98 @@ def decode_access_token(token: str) -> dict:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token", headers={"WWW-Authenticate": "Bearer"})
 
 
-async def get_aggregator_from_token(token: str = Depends(oauth2_scheme)) -> AggregatorORM:
+async def get_aggregator_from_token(token: str = Depends(oauth2_scheme)) -> Aggregator:
     try:
         payload = decode_access_token(token)
-        aggregator = await AggregatorORM.get(username=payload.get('sub')).prefetch_related('agents')
+        aggregator = await Aggregator.resolve(payload.get('sub'))
         return aggregator
     except Exception:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unable to find user", headers={"WWW-Authenticate": "Bearer"})
 
 
+async def agents_page(username: str, cursor: str | None = None, limit: int = PAGE_SIZE) -> tuple[list[dict], str | None]:
+    rows, cursor = await keyset(AgentORM.filter(aggregator_id=username), order=('agent_id', 'id'), fields=('name', 'mobile'), cursor=cursor,
+                                limit=limit)
+    return [Agent(**row).dict(by_alias=True) for row in rows], cursor
+
+
+async def reports_page(username: str, cursor: str | None = None, limit: int = PAGE_SIZE) -> tuple[list[dict], str | None]:
+    rows, cursor = await keyset(ReportORM.filter(aggregator_id=username), order=('date', 'name'), fields=('url',), cursor=cursor, limit=limit,
+                                descending=True)
+    return [Report(**row).dict(by_alias=True) for row in rows], cursor
+
+
 @error_handler(error="Unable to get user data")
-async def get_aggregator(aggregator: AggregatorORM = Depends(get_aggregator_from_token)) -> ResponseModel:
-    agents = [Agent.from_orm(agent) for agent in aggregator.agents]
-    aggregator: Aggregator = Aggregator.from_orm(aggregator)
-    data = aggregator.dict(exclude_none=True)
-    data['agents'] = agents
+async def get_aggregator(aggregator: Aggregator = Depends(get_aggregator_from_token)) -> ResponseModel:
+    agents, cursor = await agents_page(aggregator.username)
+    data = aggregator.dict(exclude_none=True, exclude={'password'})
+    data.update(agents=agents, agentsCursor=cursor)
     return ResponseModel(message="Successful", data=data)
 
 
 @error_handler(error="Incorrect Password or Username")
 async def authenticate(login: OAuth2PasswordRequestForm = Depends()) -> ResponseModel:
-    user = await AggregatorORM.get(username=login.username).prefetch_related('agents', 'reports')
-    agg = Aggregator(username=user.username, password=user.password, email=user.email)
-    reports = [Report(**obj).dict(by_alias=True) for obj in await user.reports.all().values()]
-    agents = [Agent.from_orm(obj).dict(by_alias=True) for obj in user.agents]
-    data = {'password': user.password, 'sub': user.username}
-    token = create_access_token(data)
+    user = await AggregatorORM.get(username=login.username)
+    if not compare_digest(login.password.encode(), user.password.encode()):
+        raise ValueError(f"Wrong password for {login.username}")
+    agg = Aggregator(username=user.username, email=user.email)
+    agents, agents_cursor = await agents_page(user.username)
+    reports, reports_cursor = await reports_page(user.username)
+    token = create_access_token({'sub': user.username})
     return ResponseModel(message="Login Successful", data={'token': token, **agg.dict(exclude_none=True, exclude={'password'}), "agents": agents,
-                                                           'reports': reports})
+                                                           'agentsCursor': agents_cursor, 'reports': reports, 'reportsCursor': reports_cursor})
+
+
+@error_handler(error="Unable to get agents")
+async def list_agents(cursor: str | None = None, limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      aggregator: Aggregator = Depends(get_aggregator_from_token)) -> ResponseModel:
+    agents, cursor = await agents_page(aggregator.username, cursor=cursor, limit=limit)
+    return ResponseModel(message="Successful", data={'agents': agents, 'cursor': cursor})
+
+
+@error_handler(error="Unable to get reports")
+async def list_reports(cursor: str | None = None, limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       aggregator: Aggregator = Depends(get_aggregator_from_token)) -> ResponseModel:
+    reports, cursor = await reports_page(aggregator.username, cursor=cursor, limit=limit)
+    return ResponseModel(message="Successful", data={'reports': reports, 'cursor': cursor})
+
+
+@error_handler(error="Unable to get report")
+async def report_details(name: str, aggregator: Aggregator = Depends(get_aggregator_from_token)) -> ResponseModel:
+    report = await ReportORM.get(name=name, aggregator_id=aggregator.username)
+    runs = await ReportRunORM.filter(report=report).order_by('-started_at').prefetch_related('stages')
+    runs = [{'startedAt': run.started_at.isoformat(), 'status': run.status, 'wall': run.wall, 'cpu': run.cpu, 'rows': run.row_count,
+             'records': run.record_count, 'pages': run.page_count, 'pdfSize': run.pdf_size,
+             'stages': {stage.stage: {'wall': stage.wall, 'cpu': stage.cpu, 'calls': stage.calls} for stage in run.stages}} for run in runs]
+    data = Report(name=report.name, url=report.url, date=report.date).dict(by_alias=True)
+    return ResponseModel(message="Successful", data={**data, 'size': report.size, 'runs': runs})
 
 
 @error_handler(error="Unable to Process Report Try Again")
 async def create_report(target: float = Body(), agents: list[dict] = Body(), start: date = Body(), end: date = Body(),
                           aggregator: Aggregator = Depends(get_aggregator_from_token)):
-    agg = Aggregator(email=aggregator.email, password=aggregator.password, username=aggregator.username, name=aggregator.name)
-    agg = agg.dict()
+    agg = Aggregator(email=aggregator.email, username=aggregator.username, name=aggregator.name).dict()
     data = {'target': target, 'start_date': start, 'end_date': end, 'agents': agents}
-    task_id = get_report.apply_async(args=[agg, data])
-    return ResponseModel(message="Your Report Will be Available Shortly", data={'taskId': str(task_id)})
+    key = flight_key(aggregator=aggregator.username, start=start, end=end, target=float(target),
+                     agents=sorted({Agent.parse_obj(agent).agent_id for agent in agents}))
+    task_id = str(uuid4())
+    if (owner := await report_flights.claim(key, task_id)) == task_id:
+        try:
+            await Progress(username=aggregator.username, task_id=task_id).publish("queued")
+            get_report.apply_async(args=[agg, {**data, 'flight': key}], task_id=task_id)
+        except Exception:
+            await report_flights.release(key, task_id)
+            raise
+    return ResponseModel(message="Your Report Will be Available Shortly",
+                         data={'taskId': owner, 'progress': f"/api/v1/report/progress/{owner}", 'attached': owner != task_id})
+
+
+async def stream_progress(task_id: str, last_event_id: str | None = Header(None),
+                          aggregator: Aggregator = Depends(get_aggregator_from_token)) -> StreamingResponse:
+    """Server-Sent Events of a report task's progress, from the event after Last-Event-ID when the browser reconnects"""
+    progress = Progress(username=aggregator.username, task_id=task_id)
+    return StreamingResponse(progress.sse(last_id=last_event_id or "0"), media_type="text/event-stream",
+                             headers={'Cache-Control': "no-cache", 'X-Accel-Buffering': "no"})
 
 
 @error_handler(error="Something Went Wrong")
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
 
-from .dependencies import create_report, check_task
+from .dependencies import create_report, check_task, stream_progress
 from utils import ResponseModel, error_handler
 
 router = APIRouter(prefix="/api/v1/report")
@@ -17,3 +17,7 @@ async def report(res: ResponseModel = Depends(create_report)):
 async def task(res: ResponseModel = Depends(check_task)):
     return res
 
+
+@router.get('/progress/{task_id}')
+async def progress(res=Depends(stream_progress)):
+    return res
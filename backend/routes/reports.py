@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends
+
+from .dependencies import list_reports, report_details
+from utils import ResponseModel, error_handler
+
+router = APIRouter(prefix="/api/v1/reports")
+
+
+@router.get('/')
+@error_handler
+async def reports(res: ResponseModel = Depends(list_reports)):
+    return res
+
+
+@router.get('/{name}')
+@error_handler
+async def details(res: ResponseModel = Depends(report_details)):
+    return res
@@ -0,0 +1,42 @@
+import asyncio
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from models.agent_sync import AgentSync, SyncCounts
+from models.tables_orm import AggregatorORM, AgentORM
+from utils.data_models import Agent
+
+
+def test_counts():
+    class MySQL(AgentSync):
+        def __init__(self):
+            self.mysql = True
+
+    # 3 new rows (1 each), 2 changed rows (2 each), 5 unchanged rows (0 each)
+    assert MySQL().counts(size=10, existing=7, affected=3 + 2 * 2) == SyncCounts(inserted=3, updated=2, unchanged=5)
+
+
+def test_sync():
+    async def main():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={'models': ['models.tables_orm']})
+        await Tortoise.generate_schemas()
+        try:
+            agg = await AggregatorORM.create(username="agg", email="agg@example.com", password="secret")
+            agents = [Agent(agent_id=i, name=f"Agent {i}", mobile=2348000000000 + i) for i in range(25)]
+            async with in_transaction() as conn:
+                assert await AgentSync(aggregator=agg, conn=conn, chunk_size=10).sync(agents) == SyncCounts(inserted=25)
+
+            agents[3] = Agent(agent_id=3, name="Renamed", mobile=agents[3].mobile)
+            agents[4] = Agent(agent_id=4, name=agents[4].name, mobile=1)
+            agents += [Agent(agent_id=i, name=f"Agent {i}", mobile=i) for i in range(25, 30)] + [agents[0]]
+            async with in_transaction() as conn:
+                counts = await AgentSync(aggregator=agg, conn=conn, chunk_size=10).sync(agents)
+            assert counts == SyncCounts(inserted=5, updated=2, unchanged=23)
+            assert await AgentORM.filter(aggregator=agg).count() == 30
+            assert (await AgentORM.get(aggregator=agg, agent_id=3)).name == "Renamed"
+            assert (await AgentORM.get(aggregator=agg, agent_id=4)).mobile == 1
+        finally:
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
@@ -0,0 +1,26 @@
+import asyncio
+
+from fastapi.security import OAuth2PasswordRequestForm
+from tortoise import Tortoise
+
+from models.tables_orm import AggregatorORM
+from routes.dependencies import authenticate, decode_access_token
+
+
+def test_login():
+    async def main():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={'models': ['models.tables_orm']})
+        await Tortoise.generate_schemas()
+        try:
+            await AggregatorORM.create(username="agg", email="agg@example.com", password="secret")
+            wrong = await authenticate(login=OAuth2PasswordRequestForm(username="agg", password="guess", scope=""))
+            assert not wrong.status and 'token' not in wrong.data
+
+            res = await authenticate(login=OAuth2PasswordRequestForm(username="agg", password="secret", scope=""))
+            assert res.status and 'password' not in res.data
+            payload = decode_access_token(res.data['token'])
+            assert payload['sub'] == "agg" and 'password' not in payload
+        finally:
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+from benchmarks import synthetic
+from utils.env import env
+from benchmarks.suite import run_scenario, compare, CASES
+
+
+def test_synthetic_is_seeded():
+    first, second = synthetic.transactions(rows=2000, agents=50, seed=3), synthetic.transactions(rows=2000, agents=50, seed=3)
+    assert first == second
+    assert first != synthetic.transactions(rows=2000, agents=50, seed=4)
+    assert synthetic.raw_records(rows=100, seed=3) == synthetic.raw_records(rows=100, seed=3)
+
+    agents = synthetic.agents(50, seed=3)
+    names = {agent.agent_id: agent.name for agent in agents}
+    assert all(names[trans.agent_id] == trans.business_name for trans in first)
+    assert len({trans.agent_id for trans in first}) == 45
+
+
+def test_raw_pages():
+    pages = list(synthetic.raw_pages(rows=250, agents=10, page_size=100))
+    assert [len(page) for page in pages] == [100, 100, 50]
+    assert pages[0] != pages[1]
+
+
+def test_run_scenario(monkeypatch):
+    monkeypatch.delenv('APP_NAME', raising=False)
+    monkeypatch.delitem(vars(env), 'APP_NAME', raising=False)
+    result = run_scenario(agents=20, rows=500, repeat=1)
+    assert set(result['cases']) == set(CASES)
+    assert all(case['seconds'] > 0 and case['peak_rss'] > 0 for case in result['cases'].values())
+    assert result['cases']['create']['items'] == 500 and result['cases']['fanout']['items'] == 20
+
+    lines = compare({'scenarios': [result]}, {'scenarios': [result]})
+    assert len(lines) == len(CASES) + 1 and all('1.00x' in line for line in lines[1:])
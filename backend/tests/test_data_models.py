@@ -0,0 +1,40 @@
+import dataclasses
+import gc
+import tracemalloc
+
+import pytest
+
+from benchmarks.synthetic import raw_records
+from utils.data_models import Transaction
+
+
+def test_transaction():
+    records = raw_records(rows=2000, agents=10)
+    transactions = Transaction.from_page(records)
+    assert transactions == [Transaction.create(record) for record in records if record['status'] == "COMPLETED" and not record['reversed']]
+
+    trans = transactions[0]
+    assert not hasattr(trans, '__dict__')
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        trans.amount = 0
+    assert len(set(transactions)) == len(transactions)
+    assert Transaction.from_json(trans.to_json) == trans
+    assert trans.dict == dataclasses.asdict(trans)
+
+    by_agent = {}
+    for trans in transactions:
+        first = by_agent.setdefault(trans.agent_id, trans)
+        assert trans.business_name is first.business_name
+    assert len({id(trans.trans_type) for trans in transactions}) == len({trans.trans_type for trans in transactions})
+
+
+def test_transaction_footprint():
+    records = raw_records(rows=20000, agents=100)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        transactions = Transaction.from_page(records)
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert size / len(transactions) < 256
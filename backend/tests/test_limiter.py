@@ -0,0 +1,38 @@
+import asyncio
+
+from utils.limiter import AdaptiveLimiter, Outcome
+
+
+class TestAdaptiveLimiter:
+
+    def test_window(self):
+        limiter = AdaptiveLimiter(rate=1000, burst=1000, initial=4, maximum=8)
+        for _ in range(40):
+            limiter.in_flight += 1
+            limiter.release(Outcome(ok=True))
+        assert limiter.window == 8
+        limiter.in_flight += 1
+        limiter.release(Outcome(ok=False))
+        assert limiter.window == 4
+
+    def test_concurrency(self):
+        limiter = AdaptiveLimiter(rate=1000, burst=1000, initial=3, maximum=3)
+        peak = 0
+
+        async def call():
+            nonlocal peak
+            await limiter.acquire()
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.001)
+            limiter.release(Outcome(ok=True))
+
+        async def main():
+            await asyncio.gather(*(call() for _ in range(30)))
+
+        asyncio.run(main())
+        assert peak == 3 and limiter.in_flight == 0
+
+    def test_rate(self):
+        limiter = AdaptiveLimiter(rate=10, burst=1)
+        assert limiter.take() == 0
+        assert 0 < limiter.take() <= 0.1
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.loop import LoopMonitor, LoopThread, run_cpu
+
+
+def blocking_call():
+    time.sleep(0.2)
+
+
+def test_monitor(caplog):
+    monitor = LoopMonitor(threshold=0.05)
+
+    async def main():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        assert monitor.stalls == 0
+        blocking_call()
+        await asyncio.sleep(0.1)
+        monitor.stop()
+
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(main())
+    assert monitor.stalls == 1 and monitor.longest >= 0.15
+    assert "blocking_call" in caplog.text
+
+
+def test_run_cpu():
+    async def main():
+        loop_thread = threading.get_ident()
+        thread = await run_cpu(threading.get_ident)
+        assert thread != loop_thread
+        assert await run_cpu(sorted, [3, 1, 2], reverse=True) == [3, 2, 1]
+
+    asyncio.run(main())
+
+
+def test_loop_thread_startup():
+    calls = []
+
+    async def startup():
+        calls.append(len(calls))
+        await asyncio.sleep(0.1)
+        if len(calls) == 1:
+            raise ConnectionError("database is down")
+        ready.append(True)
+
+    async def task() -> bool:
+        return bool(ready)
+
+    ready = []
+    loop = LoopThread(startup=startup)
+    with pytest.raises(ConnectionError):
+        loop.run(task())
+    assert not loop.running and loop.loop is None
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: loop.run(task()), range(8)))
+    try:
+        assert results == [True] * 8 and calls == [0, 1] and loop.running
+    finally:
+        loop.stop()
+    assert not loop.running
@@ -0,0 +1,73 @@
+import asyncio
+from urllib.request import urlopen
+
+import pytest
+from httpx import AsyncClient
+
+from app import app
+from utils.env import env
+from utils.metrics import Metric, Registry, queue_depth, queue_running
+from utils.task_queue import TaskQueue
+
+
+def test_histogram():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ('stage',), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        latency.observe(value, stage="render")
+    with latency.time(stage="upload") as labels:
+        labels['stage'] = "email"
+    text = registry.render()
+    assert 'latency_seconds_bucket{stage="render",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="render",le="1"} 3' in text
+    assert 'latency_seconds_bucket{stage="render",le="+Inf"} 4' in text
+    assert 'latency_seconds_sum{stage="render"} 6.05' in text
+    assert 'latency_seconds_count{stage="email"} 1' in text and 'stage="upload"' not in text
+
+
+def test_metric_needs_samples():
+    class Summary(Metric):
+        kind = "summary"
+
+    with pytest.raises(TypeError):
+        Summary("summary", "No samples")
+
+
+def test_gauge_and_serve():
+    registry = Registry()
+    registry.gauge("depth", "Depth", func=lambda: 7)
+    counter = registry.counter("calls", "Calls", ('status',))
+    counter.inc(status='ok')
+    server = registry.serve(0, host="127.0.0.1")
+    try:
+        text = urlopen(f"http://127.0.0.1:{server.server_port}/metrics").read().decode()
+    finally:
+        server.shutdown()
+    assert "depth 7" in text and 'calls_total{status="ok"} 1' in text
+
+
+def test_task_queue_gauges():
+    async def work(value):
+        await asyncio.sleep(0.001)
+        return value
+
+    async def main():
+        queue = TaskQueue(coroutine=work, args=[{'value': i} for i in range(20)], workers=4, name="metrics-test")
+        assert queue_depth.values[('metrics-test',)] == 20
+        await queue.run()
+
+    asyncio.run(main())
+    assert queue_depth.values[('metrics-test',)] == 0 and queue_running.values[('metrics-test',)] == 0
+
+
+def test_metrics_endpoint(monkeypatch):
+    async def scrape(**headers) -> int:
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            return (await client.get("/metrics", headers=headers)).status_code
+
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    monkeypatch.delitem(vars(env), 'METRICS_TOKEN', raising=False)
+    assert asyncio.run(scrape()) == 404
+    monkeypatch.setenv('METRICS_TOKEN', "scrape")
+    assert asyncio.run(scrape()) == asyncio.run(scrape(Authorization="Bearer wrong")) == 404
+    assert asyncio.run(scrape(Authorization="Bearer scrape")) == 200
@@ -0,0 +1,52 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from uuid import uuid4
+
+import pytest
+from tortoise import Tortoise
+
+from models.tables_orm import AggregatorORM, AgentORM, ReportORM
+from utils.pagination import encode_cursor, decode_cursor, keyset
+
+
+def test_cursor():
+    values = [datetime(2022, 12, 1, 8, 30, tzinfo=timezone.utc), uuid4(), "Report 12", 42]
+    assert decode_cursor(encode_cursor(values)) == values
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_keyset():
+    async def pages(query, **kwargs) -> list[list[dict]]:
+        result, cursor = [], None
+        while True:
+            rows, cursor = await keyset(query, cursor=cursor, **kwargs)
+            result.append(rows)
+            if cursor is None:
+                return result
+
+    async def main():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={'models': ['models.tables_orm']})
+        await Tortoise.generate_schemas()
+        try:
+            agg = await AggregatorORM.create(username="agg", email="agg@example.com", password="secret")
+            other = await AggregatorORM.create(username="other", email="other@example.com", password="secret")
+            await AgentORM.bulk_create([AgentORM(agent_id=i * 7 % 50, name=f"Agent {i}", mobile=i, aggregator=agg) for i in range(50)]
+                                       + [AgentORM(agent_id=1, name="Other", mobile=1, aggregator=other)])
+            start = datetime(2022, 12, 1, tzinfo=timezone.utc)
+            for i in range(11):
+                await ReportORM.create(name=f"Report {i:02}", url=f"https://example.com/{i}", aggregator=agg)
+                await ReportORM.filter(name=f"Report {i:02}").update(date=start + timedelta(days=i // 3))
+
+            agents = await pages(AgentORM.filter(aggregator=agg), order=('agent_id', 'id'), fields=('name',), limit=8)
+            assert [len(page) for page in agents] == [8] * 6 + [2]
+            rows = [row for page in agents for row in page]
+            assert len({row['id'] for row in rows}) == 50
+            assert [row['agent_id'] for row in rows] == sorted(row['agent_id'] for row in rows)
+
+            reports = await pages(ReportORM.filter(aggregator=agg), order=('date', 'name'), fields=('url',), limit=4, descending=True)
+            assert [row['name'] for page in reports for row in page] == [f"Report {i:02}" for i in reversed(range(11))]
+        finally:
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
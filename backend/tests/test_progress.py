@@ -0,0 +1,149 @@
+import asyncio
+import json
+from datetime import date
+
+from httpx import AsyncClient
+
+from benchmarks.upstream import FakeUpstream, UpstreamConfig
+from utils import progress, worker
+from utils.client import ClientTransaction
+from utils.data_models import Auth
+from utils.loop import LoopThread
+from utils.progress import Progress
+
+
+class Streams:
+    """Just enough of the redis stream commands for Progress"""
+
+    def __init__(self):
+        self.streams: dict[str, list] = {}
+        self.added = asyncio.Event()
+
+    def events(self, key: str) -> list[dict]:
+        return [json.loads(fields['event']) for _, fields in self.streams.get(key, [])]
+
+    async def exists(self, key: str) -> int:
+        return int(key in self.streams)
+
+    async def expire(self, key: str, ttl: int):
+        ...
+
+    async def xadd(self, key: str, fields: dict, **kwargs):
+        entries = self.streams.setdefault(key, [])
+        entries.append((f"1-{len(entries)}", fields))
+        self.added.set()
+        self.added = asyncio.Event()
+
+    async def xread(self, streams: dict, count: int, block: int) -> list:
+        (key, last), = streams.items()
+        after = int(last.split('-')[-1]) if '-' in last else -1
+        while not (entries := self.streams.get(key, [])[after + 1:]):
+            try:
+                await asyncio.wait_for(self.added.wait(), block / 1000)
+            except asyncio.TimeoutError:
+                return []
+        return [[key, entries[:count]]]
+
+    def pipeline(self, transaction: bool = True) -> 'Pipeline':
+        return Pipeline(self)
+
+
+class Pipeline:
+    def __init__(self, redis: Streams):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        ...
+
+    def xadd(self, *args, **kwargs):
+        self.calls.append(self.redis.xadd(*args, **kwargs))
+
+    def expire(self, *args):
+        self.calls.append(self.redis.expire(*args))
+
+    async def execute(self):
+        return [await call for call in self.calls]
+
+
+def test_progress(monkeypatch):
+    async def main():
+        redis = Streams()
+        monkeypatch.setattr(progress, 'get_redis', lambda: redis)
+        task = Progress(username="agg", task_id="task")
+        await task.publish("queued")
+        task.update("fetching", page=1, pages=3)
+        task.update("fetching", page=2, pages=3)
+        task.update("rendering")
+        await task.close()
+        assert [(event['stage'], event.get('page')) for event in redis.events(task.key)] == [("queued", None), ("fetching", 2), ("rendering", None)]
+
+        async def listen() -> list[str]:
+            return [message async for message in task.sse(block=0.01)]
+
+        listener = asyncio.create_task(listen())
+        await asyncio.sleep(0.03)
+        await task.publish("done", url="https://example.com/report.pdf")
+        messages = await listener
+        assert messages[:3] == [f"id: 1-{i}\nevent: progress\ndata: {json.dumps(event)}\n\n" for i, event in enumerate(redis.events(task.key)[:3])]
+        assert ": keep-alive\n\n" in messages and json.loads(messages[-1].split("data: ")[1])['url'] == "https://example.com/report.pdf"
+
+        assert [event['stage'] async for _, event in task.events(last_id="1-1")] == ["rendering", "done"]
+        assert [event async for _, event in Progress(username="other", task_id="task").events()] == [{'stage': 'unknown'}]
+        assert [event async for _, event in Progress(username="agg").events()] == [{'stage': 'unknown'}]
+
+        stalled = Progress(username="agg", task_id="stalled")
+        await stalled.publish("started")
+        assert [event async for _, event in stalled.events(block=0.01, timeout=0.03)][-1] == {'stage': 'timeout'}
+
+        async def expire():
+            await asyncio.sleep(0.03)
+            del redis.streams[stalled.key]
+
+        expiry = asyncio.create_task(expire())
+        events = [event async for _, event in stalled.events(block=0.01)]
+        await expiry
+        assert events[0]['stage'] == "started" and None in events and events[-1] == {'stage': 'expired'}
+
+        Progress(username="agg").update("started")
+        assert list(redis.streams) == [task.key]
+        monkeypatch.setattr(progress, 'get_redis', lambda: None)
+        assert [event async for _, event in task.events()] == [{'stage': 'unavailable'}]
+
+    asyncio.run(main())
+
+
+def test_page_progress(monkeypatch):
+    for name, value in (('AUTHORITY', "upstream.test"), ('ORIGIN', "http://upstream.test"), ('REFERER', "http://upstream.test")):
+        monkeypatch.setenv(name, value)
+
+    async def main():
+        redis = Streams()
+        monkeypatch.setattr(progress, 'get_redis', lambda: redis)
+        upstream = FakeUpstream(UpstreamConfig(agents=10, rows=250))
+        http = AsyncClient(transport=upstream.transport(), base_url="http://upstream.test")
+        client = ClientTransaction(Auth(username="pages", password="secret"), client=http)
+        client.params['pageSize'] = 100
+        task = Progress(username="pages", task_id="task")
+        with task.activate():
+            pages = [page async for page in client.iter_consolidated_transactions(start_date=date(2022, 12, 1), end_date=date(2022, 12, 31))]
+        await task.close()
+        await client.close()
+        assert len(pages) == 3
+        assert redis.events(task.key)[-1] | {'time': 0} == {'stage': 'fetching', 'page': 3, 'pages': 3, 'time': 0}
+
+    asyncio.run(main())
+
+
+def test_failed_report_task(monkeypatch):
+    redis = Streams()
+    monkeypatch.setattr(progress, 'get_redis', lambda: redis)
+    monkeypatch.setattr(worker, 'loop', LoopThread())
+    try:
+        worker.get_report.apply(args=[{'username': "agg"}, {'agents': []}], task_id="task")
+    finally:
+        worker.loop.stop()
+    assert [event['stage'] for event in redis.events(Progress(username="agg", task_id="task").key)] == ["failed"]
@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from tortoise import Tortoise
+
+from models.aggregator import Aggregator, AggregatorORM
+from models.tables_orm import ReportORM
+
+
+def test_evict_reports():
+    async def main():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={'models': ['models.tables_orm']})
+        await Tortoise.generate_schemas()
+        try:
+            for username in ("agg", "other"):
+                await AggregatorORM.create(username=username, email=f"{username}@example.com", password="secret", name=username)
+            now = datetime.now()
+            for days in (1, 10, 40, 90):
+                for username in ("agg", "other"):
+                    await ReportORM.create(name=f"{username}-{days}", url=f"https://example.com/{username}-{days}.pdf", aggregator_id=username,
+                                           digest="same", size=1000)
+                    await ReportORM.filter(name=f"{username}-{days}").update(date=now - timedelta(days=days))
+
+            aggregator = Aggregator(username="agg", email="agg@example.com", password="secret")
+            assert (await aggregator.cached_report(digest="same")).name == "agg-1"
+
+            async def cached(username: str = "agg") -> list[str]:
+                return await ReportORM.filter(aggregator_id=username, digest__not_isnull=True).order_by('date').values_list('name', flat=True)
+
+            await aggregator.evict_reports(max_age=timedelta(days=60))
+            assert await cached() == ["agg-40", "agg-10", "agg-1"]
+            await aggregator.evict_reports(max_age=timedelta(days=30))
+            assert await cached() == ["agg-10", "agg-1"]
+            await aggregator.evict_reports(max_age=timedelta(days=5))
+            assert await cached() == ["agg-1"] and (await aggregator.cached_report(digest="same")).name == "agg-1"
+
+            assert await ReportORM.filter(aggregator_id="agg").count() == 4
+            assert len(await cached("other")) == 4
+        finally:
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
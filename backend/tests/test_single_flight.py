@@ -0,0 +1,108 @@
+import asyncio
+import json
+from datetime import date
+
+from models.aggregator import Aggregator
+from routes import dependencies
+from utils import progress, single_flight, worker
+from utils.loop import LoopThread
+from utils.single_flight import SingleFlight, flight_key, report_flights
+
+
+class Keys:
+    """Just enough of redis for SingleFlight"""
+
+    def __init__(self):
+        self.data: dict[str, str] = {}
+        self.refreshed = 0
+
+    async def set(self, key: str, value: str, nx: bool = False, ex: int | None = None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def get(self, key: str) -> str | None:
+        return self.data.get(key)
+
+    async def eval(self, script: str, keys: int, key: str, owner: str, *args) -> int:
+        if self.data.get(key) != owner:
+            return 0
+        if script == single_flight.REFRESH:
+            self.refreshed += 1
+        else:
+            del self.data[key]
+        return 1
+
+
+def test_single_flight(monkeypatch):
+    async def main():
+        redis = Keys()
+        monkeypatch.setattr(single_flight, 'get_redis', lambda: redis)
+        flights = SingleFlight(prefix="test:", ttl=60)
+        assert flight_key(agents=[1, 2], target=5) == flight_key(target=5, agents=[1, 2]) != flight_key(agents=[1, 2], target=6)
+
+        assert await flights.claim("key", "a") == "a"
+        assert await flights.claim("key", "b") == "a"
+        await flights.release("key", "b")
+        assert await flights.claim("key", "c") == "a"
+        await flights.release("key", "a")
+        assert await flights.claim("key", "d") == "d"
+
+        flights.ttl = 0.03
+        assert await flights.hold("key", "d", asyncio.sleep(0.1, result="report")) == "report"
+        assert redis.refreshed >= 2 and await flights.refresh("key", "d")
+        refreshed = redis.refreshed
+        await asyncio.sleep(0.05)
+        assert redis.refreshed == refreshed and not await flights.refresh("key", "other")
+
+        monkeypatch.setattr(single_flight, 'get_redis', lambda: None)
+        assert await flights.claim("key", "e") == "e"
+
+    asyncio.run(main())
+
+
+def test_create_report_coalesces(monkeypatch):
+    class Task:
+        calls = []
+
+        @classmethod
+        def apply_async(cls, args, task_id):
+            cls.calls.append((args, task_id))
+
+    async def generate_report(*, task_id: str, **kwargs):
+        reports.append(task_id)
+
+    reports = []
+
+    async def main():
+        redis = Keys()
+        monkeypatch.setattr(single_flight, 'get_redis', lambda: redis)
+        monkeypatch.setattr(progress, 'get_redis', lambda: None)
+        monkeypatch.setattr(dependencies, 'get_report', Task)
+        monkeypatch.setattr('utils.functions.generate_report', generate_report)
+        monkeypatch.setattr(worker, 'loop', LoopThread())
+        aggregator = Aggregator(username="agg", email="agg@example.com", password="secret")
+        request = {'target': 1000, 'start': date(2022, 12, 1), 'end': date(2022, 12, 2), 'aggregator': aggregator}
+
+        a, b = {'agentId': 1, 'name': "A", 'mobile': 1}, {'agentId': 2, 'name': "B", 'mobile': 1}
+        first = await dependencies.create_report(agents=[b, a], **request)
+        second = await dependencies.create_report(agents=[{'agent_id': 1, 'name': "A", 'mobile': 1}, b], **request)
+        other = await dependencies.create_report(agents=[], **request)
+        assert second.data['taskId'] == first.data['taskId'] != other.data['taskId']
+        assert (first.data['attached'], second.data['attached'], other.data['attached']) == (False, True, False)
+        assert [task_id for _, task_id in Task.calls] == [first.data['taskId'], other.data['taskId']]
+
+        args, task_id = Task.calls[0]
+        await asyncio.to_thread(worker.get_report.apply, args=json.loads(json.dumps(args, default=str)), task_id=task_id)
+        assert list(redis.data) == [report_flights.prefix + Task.calls[1][0][1]['flight']]
+        assert reports == [task_id]
+        again = await dependencies.create_report(agents=[a, b], **request)
+        same = await dependencies.create_report(agents=[], **{**request, 'target': 1000.0})
+        assert not again.data['attached'] and again.data['taskId'] != first.data['taskId']
+        assert same.data['attached'] and same.data['taskId'] == other.data['taskId']
+
+    try:
+        asyncio.run(main())
+    finally:
+        worker.loop.stop()
@@ -0,0 +1,46 @@
+import asyncio
+
+from utils.task_queue import TaskQueue
+
+
+async def job(*, n: int, delay: float = 0):
+    await asyncio.sleep(delay)
+    if n == 3:
+        raise ValueError("bad input")
+    return n * 2
+
+
+class TestTaskQueue:
+
+    def test_run(self):
+        args = [{'n': n, 'delay': (10 - n) / 1000} for n in range(10)]
+        queue = TaskQueue(job, args=args, workers=4)
+        results = asyncio.run(queue.run())
+        assert results == [n * 2 for n in range(10) if n != 3]
+        assert list(queue.errors) == [3]
+        assert queue.stats.completed == 9 and queue.stats.failed == 1 and queue.stats.queued == 0
+
+    def test_timeout(self):
+        queue = TaskQueue(job, args=[{'n': 1, 'delay': 1}, {'n': 2}], timeout=0.05)
+        assert asyncio.run(queue.run()) == [4]
+        assert queue.stats.timed_out == 1
+
+    def test_bounded(self):
+        running = peak = 0
+
+        async def tracked(**kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+
+        asyncio.run(TaskQueue(tracked, args=[{}] * 50, workers=5).run())
+        assert peak == 5
+
+    def test_iteration(self):
+        async def main():
+            queue = TaskQueue(job, args=[{'n': n, 'delay': (5 - n) / 100} for n in range(5)], workers=5)
+            return [outcome.index async for outcome in queue]
+
+        assert asyncio.run(main()) == [4, 3, 2, 1, 0]
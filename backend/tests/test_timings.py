@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+from utils.loop import run_cpu
+from utils.timings import ReportTimings, stage, count
+
+
+def spin(seconds: float):
+    with stage("aggregate"):
+        end = time.thread_time() + seconds
+        while time.thread_time() < end:
+            ...
+
+
+def test_report_timings():
+    async def fetch():
+        with stage("fetch"):
+            await asyncio.sleep(0.02)
+        count("pages")
+
+    async def main() -> ReportTimings:
+        with ReportTimings().activate() as timings:
+            await asyncio.gather(*(fetch() for _ in range(3)))
+            await run_cpu(spin, 0.02)
+        with stage("fetch"):
+            count("pages")
+        return timings
+
+    timings = asyncio.run(main())
+    assert timings.counts == {'pages': 3}
+    assert timings.stages['fetch'].calls == 3 and timings.stages['fetch'].wall >= 0.06 > timings.wall - 0.02
+    assert timings.stages['aggregate'].cpu >= 0.02 and timings.cpu >= 0.02
@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from random import Random
+
+import pytest
+
+from models.transaction import Transactions, Transaction, Agent, ReportContent, render
+from utils.data_models import AgentFilter, TimeFilter
+from utils.batch import TransactionBatch, SummaryAccumulator
+from utils.memo import LRU, lazy
+from utils.env import env
+
+
+def make_transactions(n=500, agents=20, seed=7) -> list[Transaction]:
+    rand = Random(seed)
+    start = datetime(2022, 12, 1)
+    return [Transaction(business_name=f"Business {i % agents}", time=start + timedelta(minutes=rand.randint(0, 1440 * 30)),
+                        trans_type=rand.choice(("CASH_OUT", "AIRTIME", "TRANSFER")), agent_id=i % agents, amount=rand.randint(100, 10 ** 7))
+            for i in range(n)]
+
+
+class TestTransactions:
+    transactions = make_transactions()
+    agents = [Agent(agent_id=i, name=f"Business {i}", mobile=2348000000000 + i) for i in range(25)]
+
+    def expected(self, trans_filter=lambda trans: True) -> dict[int, dict]:
+        data = {}
+        for trans in self.transactions:
+            if not trans_filter(trans):
+                continue
+            row = data.setdefault(trans.agent_id, {'amount': 0})
+            row['amount'] += trans.amount
+            row[trans.trans_type] = row.get(trans.trans_type, 0) + 1
+        return data
+
+    def test_data(self):
+        trans = Transactions(title="Test", transactions=self.transactions, agents=self.agents, target=30000)
+        expected = self.expected()
+        assert set(trans.data) == set(expected)
+        for key, value in expected.items():
+            summary = trans.data[key].dict()
+            assert summary['amount'] == value.pop('amount') / 100
+            assert {k: summary[k] for k in value} == value
+
+    def test_filters(self):
+        agent_filter = AgentFilter(agents=[1, 2, 3])
+        trans = Transactions(title="Agents", transactions=self.transactions, target=30000, filter=agent_filter)
+        assert set(trans.data) == {1, 2, 3}
+
+        time_filter = TimeFilter(start=time(hour=8), end=time(hour=11, minute=59, second=59))
+        trans = Transactions(title="Morning", transactions=self.transactions, target=30000, filter=time_filter)
+        expected = self.expected(lambda tr: time_filter(trans=tr))
+        assert {key: value.amount for key, value in trans.data.items()} == {key: value['amount'] / 100 for key, value in expected.items()}
+
+        edges = [Transaction(business_name="Edge", time=datetime(2022, 12, 1, 11, 59, 59, micro), trans_type="AIRTIME", agent_id=1)
+                 for micro in (0, 500_000)]
+        batch = TransactionBatch.from_transactions(edges)
+        assert time_filter.mask(batch).tolist() == [time_filter(trans=trans) for trans in edges] == [True, False]
+
+    def test_views(self):
+        trans = Transactions(title="Views", transactions=self.transactions, agents=self.agents, target=30000)
+        amounts = [trans.data[key].amount for key in trans.sort_data]
+        assert amounts == sorted(amounts, reverse=True)
+        assert trans.table_data()[0] == ['Business Name', "Amount"]
+        assert all(value.amount < 30000 for value in trans.get_below_target_agents().values())
+        assert trans.get_non_performing_agents()[1:] == [[f"Business {i}"] for i in range(20, 25)]
+
+    def test_streaming_summary(self):
+        accumulator = SummaryAccumulator(filter=AgentFilter(agents=list(range(15))), capacity=2)
+        for i in range(0, len(self.transactions), 37):
+            accumulator.fold(TransactionBatch.from_transactions(self.transactions[i:i + 37]))
+        streamed = Transactions(title="Streamed", summary=accumulator.result(), agents=self.agents, target=30000)
+        batch = Transactions(title="Batch", transactions=self.transactions, agents=self.agents, target=30000,
+                             filter=AgentFilter(agents=list(range(15))))
+        assert accumulator.rows == len(batch.batch)
+        assert {key: value.dict() for key, value in streamed.data.items()} == {key: value.dict() for key, value in batch.data.items()}
+        assert streamed.table_data() == batch.table_data()
+
+    def test_digest(self):
+        first = Transactions(title="Report 12", transactions=self.transactions, agents=self.agents, target=30000)
+        second = Transactions(title="Report 873", transactions=list(reversed(self.transactions)), agents=self.agents, target=30000)
+        assert first.digest(start_date="2022-12-01") == second.digest(start_date="2022-12-01")
+        assert first.digest(start_date="2022-12-01") != first.digest(start_date="2022-12-02")
+        second.target = 40000
+        assert first.digest() != second.digest()
+
+    def test_memo(self):
+        first = Transactions(title="Same", transactions=self.transactions[:100], agents=self.agents, target=30000)
+        second = Transactions(title="Same", transactions=self.transactions[100:], agents=self.agents, target=30000)
+        assert first.data is first.data
+        assert first.data != second.data
+
+        below = first.get_below_target_agents()
+        first.target = 10 ** 9
+        assert set(first.get_below_target_agents()) == set(first.data) != set(below)
+
+        first.invalidate('data')
+        assert 'data' not in first._memo and 'summaries' in first._memo
+
+        copy = Transactions(title="Copy", transactions=list(reversed(self.transactions[:100])), agents=self.agents, target=30000)
+        hits = lazy.shared.hits
+        assert copy.data is first.data
+        assert lazy.shared.hits == hits + 2
+
+        key = next(iter(copy.data))
+        with pytest.raises(TypeError):
+            copy.data[key] = copy.data[key]
+        with pytest.raises(TypeError):
+            copy.data[key].amount = 0
+        assert isinstance(copy.sort_data, tuple)
+
+
+def test_lru():
+    cache = LRU(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+
+    def hammer(start: int):
+        for i in range(start, start + 2000):
+            cache.put(i % 50, i)
+            cache.get((i * 7) % 50)
+
+    cache = LRU(maxsize=10)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(hammer, range(0, 16000, 2000)))
+    assert len(cache) == 10 and cache.hits + cache.misses == 16000
+
+
+def test_render_without_app_name(monkeypatch):
+    monkeypatch.delenv('APP_NAME', raising=False)
+    monkeypatch.delitem(vars(env), 'APP_NAME', raising=False)
+    trans = Transactions(title="Test", transactions=make_transactions(), agents=TestTransactions.agents, target=30000)
+    assert render(trans.report_content()).startswith(b"%PDF")
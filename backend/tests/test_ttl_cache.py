@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from tortoise import Tortoise
+
+from models.aggregator import Aggregator, AggregatorORM, profiles
+from utils.ttl_cache import TTLCache
+
+
+def test_ttl_cache():
+    async def main():
+        cache = TTLCache(prefix="test:", ttl=60, local_ttl=0.05, maxsize=2)
+        await cache.set('a', {'value': 1})
+        assert await cache.get('a') == {'value': 1}
+        await cache.set('b', {'value': 2})
+        await cache.set('c', {'value': 3})
+        assert len(cache.local) == 2 and await cache.get('a') is None
+        await cache.delete('b')
+        assert await cache.get('b') is None
+        time.sleep(0.06)
+        assert await cache.get('c') is None
+
+    asyncio.run(main())
+
+
+def test_profile_cache():
+    async def main():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={'models': ['models.tables_orm']})
+        await Tortoise.generate_schemas()
+        try:
+            await AggregatorORM.create(username="agg", email="agg@example.com", password="secret", name="Old")
+            assert (await Aggregator.resolve("agg")).name == "Old"
+            assert 'password' not in await profiles.get("agg")
+            aggregator = await Aggregator.resolve("agg")
+            assert aggregator.password == "" and (await aggregator.credentials()).password == aggregator.session.auth.password == "secret"
+            await AggregatorORM.filter(username="agg").update(name="Stale")
+            assert (await Aggregator.resolve("agg")).name == "Old"
+
+            aggregator = await Aggregator.resolve("agg")
+            await aggregator.update(name="New")
+            assert (await Aggregator.resolve("agg")).name == "New"
+        finally:
+            await profiles.delete("agg")
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import date
+
+import pytest
+from httpx import AsyncClient, MockTransport, Request, Response
+
+from benchmarks.upstream import FakeUpstream, UpstreamConfig
+from benchmarks.load import fetch
+from utils.client import ClientTransaction
+from utils.data_models import Auth
+
+URL = "http://upstream.test"
+
+
+def test_paging_contract():
+    async def main():
+        upstream = FakeUpstream(UpstreamConfig(agents=10, rows=2500, password="secret"))
+        async with AsyncClient(transport=upstream.transport(), base_url=URL) as client:
+            res = await client.get("/agents")
+            assert res.status_code == 401
+            res = await client.post("/auth/tokens", json={'username': "a", 'password': "wrong"})
+            assert res.json()['responseCode'] == "invalid_grant"
+            token = (await client.post("/auth/tokens", json={'username': "a", 'password': "secret"})).json()['tokenData']['access_token']
+
+            headers = {'Authorization': f"Bearer {token}"}
+            url = "/aggregators/consolidated-transactions/"
+            pages = [(await client.get(url, headers=headers, params={'pageNumber': n, 'pageSize': 1000})).json() for n in (1, 2, 3)]
+            assert all(page['responseCode'] == "20000" and page['totalPages'] == 3 for page in pages)
+            assert [len(page['consolidatedTransactions']) for page in pages] == [1000, 1000, 500]
+
+            res = (await client.get(url, headers=headers, params={'agentId': 10003, 'startDate': "2022-12-10", 'endDate': "2022-12-10"})).json()
+            records = res['consolidatedTransactions']
+            assert records and all(r['agent']['id'] == 10003 and r['createdOn'].startswith("2022-12-10") for r in records)
+
+            async with AsyncClient(app=upstream, base_url=URL) as asgi:
+                res = await asgi.get("/agents", headers=headers, params={'pageSize': 4, 'pageNumber': 3})
+                assert res.json()['totalPages'] == 3 and [agent['id'] for agent in res.json()['agents']] == [10008, 10009]
+
+    asyncio.run(main())
+
+
+def test_throttling():
+    async def main():
+        upstream = FakeUpstream(UpstreamConfig(agents=10, rows=100, latency=0.01, max_in_flight=2, retry_after=0.5))
+        async with AsyncClient(transport=upstream.transport(), base_url=URL) as client:
+            responses = await asyncio.gather(*(client.post("/auth/tokens", json={}) for _ in range(5)))
+        assert sorted(res.status_code for res in responses) == [200, 200, 429, 429, 429]
+        assert all(res.headers['retry-after'] == "0.5" for res in responses if res.status_code == 429)
+        assert upstream.stats.peak_in_flight == 3 and upstream.stats.statuses[429] == 3
+
+    asyncio.run(main())
+
+
+def test_client_fetches_every_page(monkeypatch):
+    for name, value in (('AUTHORITY', "upstream.test"), ('ORIGIN', URL), ('REFERER', URL)):
+        monkeypatch.setenv(name, value)
+    upstream = FakeUpstream(UpstreamConfig(agents=20, rows=3000))
+    result = asyncio.run(fetch(upstream, concurrency=4, page_size=500))
+    expected = sum(1 for r in upstream.records if r['status'] == "COMPLETED" and not r['reversed'])
+    assert result['pages'] == 6 and result['transactions'] == expected and not result['error']
+    assert result['requests'] == 7 and result['statuses'] == {'200': 7}
+
+    async def agents():
+        client = ClientTransaction(Auth(username="agents", password="secret"), client=AsyncClient(transport=upstream.transport(), base_url=URL))
+        client.params['pageSize'] = 7
+        try:
+            return await client.get_agents(), await client.profile()
+        finally:
+            await client.close()
+
+    agents, profile = asyncio.run(agents())
+    assert [agent.agent_id for agent in agents] == list(range(10000, 10020)) and profile.name == "Ada Obi"
+
+
+def test_pages_cancelled_on_close(monkeypatch):
+    for name, value in (('AUTHORITY', "upstream.test"), ('ORIGIN', URL), ('REFERER', URL)):
+        monkeypatch.setenv(name, value)
+    started, cancelled = [], []
+
+    async def handler(request: Request) -> Response:
+        if (number := int(request.url.params['pageNumber'])) > 1:
+            started.append(number)
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(number)
+                raise
+        return Response(200, json={'responseCode': "20000", 'totalPages': 5, 'items': [number]})
+
+    async def main():
+        client = ClientTransaction(Auth(username="pages", password="secret"), client=AsyncClient(transport=MockTransport(handler), base_url=URL))
+        try:
+            for ordered in (True, False):
+                started.clear(), cancelled.clear()
+                pages = client.pages(url="/items", key='items', params={}, concurrency=3, ordered=ordered)
+                assert await anext(pages) == [1]
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(anext(pages), 0.05)
+                await pages.aclose()
+                await asyncio.sleep(0)
+                assert sorted(started) == sorted(cancelled) == [2, 3, 4]
+        finally:
+            await client.close()
+
+    asyncio.run(main())
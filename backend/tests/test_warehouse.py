@@ -0,0 +1,169 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from operator import itemgetter
+
+from httpx import AsyncClient
+from tortoise import Tortoise
+
+from benchmarks.upstream import FakeUpstream, UpstreamConfig
+from models.tables_orm import AggregatorORM, TransactionORM, SyncWindowORM, DailyRollupORM
+from models.warehouse import TransactionWarehouse
+from utils.batch import SummaryAccumulator, TransactionBatch
+from utils.client import ClientTransaction
+from utils.data_models import AgentFilter, Auth, Transaction
+from utils.db import db_time, epoch
+
+URL = "http://upstream.test"
+TRANSACTIONS = "/aggregators/consolidated-transactions/"
+
+
+def upstream_headers(monkeypatch):
+    for name, value in (('AUTHORITY', "upstream.test"), ('ORIGIN', URL), ('REFERER', URL)):
+        monkeypatch.setenv(name, value)
+
+
+def expected(upstream: FakeUpstream, start: date, end: date) -> int:
+    return sum(1 for r in upstream.records
+               if r['status'] == "COMPLETED" and not r['reversed'] and start.isoformat() <= r['createdOn'][:10] <= end.isoformat())
+
+
+def test_db_time():
+    wat = datetime(2022, 12, 1, 23, 30, tzinfo=timezone(timedelta(hours=1)))
+    assert db_time(wat) == db_time(wat.astimezone(timezone.utc)) == datetime(2022, 12, 1, 22, 30)
+    assert db_time(datetime(2022, 12, 1, 23, 30)) == datetime(2022, 12, 1, 23, 30)
+    assert epoch(db_time(wat)) == epoch(wat) == wat.timestamp()
+
+
+def test_ranges():
+    days = [date(2022, 12, d) for d in (1, 2, 3, 5, 7, 8)]
+    assert TransactionWarehouse.ranges(days) == [(date(2022, 12, 1), date(2022, 12, 3)), (date(2022, 12, 5), date(2022, 12, 5)),
+                                                 (date(2022, 12, 7), date(2022, 12, 8))]
+
+
+def test_sync(monkeypatch):
+    upstream_headers(monkeypatch)
+    start, end, today = date(2022, 12, 1), date(2022, 12, 5), date(2022, 12, 5)
+    monkeypatch.setattr(TransactionWarehouse, 'is_closed', lambda self, day, now=None: day < today)
+
+    async def main():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={'models': ['models.tables_orm']})
+        await Tortoise.generate_schemas()
+        upstream = FakeUpstream(UpstreamConfig(agents=10, rows=3000, password="secret"))
+        session = ClientTransaction(Auth(username="agg", password="secret"), client=AsyncClient(transport=upstream.transport(), base_url=URL))
+        session.params['pageSize'] = 100
+        try:
+            agg = await AggregatorORM.create(username="agg", email="agg@example.com", password="secret")
+            warehouse = TransactionWarehouse(aggregator=agg, session=session, batch_size=50)
+            assert await warehouse.pending_days(start_date=start, end_date=end) == warehouse.days(start, end)
+
+            assert await warehouse.sync(start_date=start, end_date=end)
+            assert await TransactionORM.filter(aggregator=agg).count() == expected(upstream, start, end)
+            windows = {w.day: w for w in await SyncWindowORM.filter(aggregator=agg)}
+            assert sorted(windows) == warehouse.days(start, end)
+            assert [day for day, w in windows.items() if not w.complete] == [today]
+            assert all(w.records == expected(upstream, day, day) for day, w in windows.items())
+            assert await warehouse.pending_days(start_date=start, end_date=end) == [today]
+
+            stored = await TransactionORM.filter(aggregator=agg, day=start).order_by('time').first()
+            record = min((r for r in upstream.records if r['createdOn'].startswith("2022-12-01") and r['status'] == "COMPLETED"
+                          and not r['reversed']), key=lambda r: r['createdOn'])
+            assert stored.time == Transaction.create(record).time
+
+            # only the open day is fetched again and its rows are replaced rather than added to
+            requests = upstream.stats.endpoints[TRANSACTIONS]
+            upstream.reset()
+            assert await warehouse.sync(start_date=start, end_date=end)
+            assert 0 < upstream.stats.endpoints[TRANSACTIONS] < requests
+            assert await TransactionORM.filter(aggregator=agg).count() == expected(upstream, start, end)
+            assert await TransactionORM.filter(aggregator=agg, day=today).count() == expected(upstream, today, today)
+            assert await SyncWindowORM.filter(aggregator=agg).count() == 5
+
+            # once every day has closed nothing is fetched at all
+            monkeypatch.setattr(TransactionWarehouse, 'is_closed', lambda self, day, now=None: True)
+            assert await warehouse.sync(start_date=start, end_date=end)
+            upstream.reset()
+            assert await warehouse.sync(start_date=start, end_date=end)
+            assert upstream.stats.endpoints[TRANSACTIONS] == 0
+            assert await TransactionORM.filter(aggregator=agg).count() == expected(upstream, start, end)
+        finally:
+            await session.close()
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
+
+
+def test_summarize(monkeypatch):
+    upstream_headers(monkeypatch)
+    start, end = date(2022, 12, 1), date(2022, 12, 5)
+
+    async def main():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={'models': ['models.tables_orm']})
+        await Tortoise.generate_schemas()
+        upstream = FakeUpstream(UpstreamConfig(agents=10, rows=3000))
+        session = ClientTransaction(Auth(username="agg", password="secret"), client=AsyncClient(transport=upstream.transport(), base_url=URL))
+        session.params['pageSize'] = 100
+        try:
+            agg = await AggregatorORM.create(username="agg", email="agg@example.com", password="secret")
+            warehouse = TransactionWarehouse(aggregator=agg, session=session, batch_size=50)
+            assert await warehouse.sync(start_date=start, end_date=date(2022, 12, 3))
+            await SyncWindowORM.filter(aggregator=agg, day=date(2022, 12, 2)).update(rolled_up=False)
+
+            chunks = [chunk async for chunk in warehouse.iter_transactions(days=warehouse.days(start, date(2022, 12, 3)), size=64)]
+            assert all(len(chunk) == 64 for chunk in chunks[:-1])
+            assert sum(map(len, chunks)) == len({trans for chunk in chunks for trans in chunk}) == expected(upstream, start, date(2022, 12, 3))
+
+            records = [r for r in upstream.records if start.isoformat() <= r['createdOn'][:10] <= end.isoformat()]
+            for agents in (None, [10001, 10004]):
+                reference = SummaryAccumulator(filter=AgentFilter(agents) if agents else None)
+                reference.fold(TransactionBatch.from_transactions(Transaction.from_page(records)))
+                for rollups in (True, False):
+                    # days 1 and 3 come from the rollups, day 2 from the stored rows and days 4 and 5 from upstream
+                    accumulator = SummaryAccumulator(filter=AgentFilter(agents) if agents else None)
+                    assert await warehouse.summarize(start_date=start, end_date=end, accumulator=accumulator, agents=agents, rollups=rollups)
+                    assert accumulator.rows == reference.rows
+                    assert sorted(accumulator.result().rows(), key=itemgetter('agent_id')) == \
+                           sorted(reference.result().rows(), key=itemgetter('agent_id'))
+                    await SyncWindowORM.filter(aggregator=agg, day__gt=date(2022, 12, 3)).delete()
+        finally:
+            await session.close()
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
+
+
+def test_rollups(monkeypatch):
+    upstream_headers(monkeypatch)
+    start, end = date(2022, 12, 1), date(2022, 12, 4)
+
+    async def main():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={'models': ['models.tables_orm']})
+        await Tortoise.generate_schemas()
+        upstream = FakeUpstream(UpstreamConfig(agents=10, rows=3000))
+        session = ClientTransaction(Auth(username="agg", password="secret"), client=AsyncClient(transport=upstream.transport(), base_url=URL))
+        try:
+            agg = await AggregatorORM.create(username="agg", email="agg@example.com", password="secret")
+            warehouse = TransactionWarehouse(aggregator=agg, session=session)
+            assert await warehouse.sync(start_date=start, end_date=end)
+            days = warehouse.days(start, end)
+            records = [r for r in upstream.records if start.isoformat() <= r['createdOn'][:10] <= end.isoformat()]
+            batch = TransactionBatch.from_transactions(Transaction.from_page(records))
+
+            def totals(summary) -> dict:
+                order = summary.agent_id.tolist()
+                rows = {row['agent_id']: row for row in summary.rows()}
+                return {agent_id: (rows[agent_id], summary.first[i], summary.last[i]) for i, agent_id in enumerate(order)}
+
+            expected = totals(batch.summarize())
+            assert totals(await warehouse.rollup_summary(days=days)) == expected
+            assert set(totals(await warehouse.rollup_summary(days=days, agents=[10002, 10005]))) == {10002, 10005}
+
+            await DailyRollupORM.filter(aggregator=agg, day__in=days[1:3]).delete()
+            await SyncWindowORM.filter(aggregator=agg, day__in=days[1:3]).update(rolled_up=False)
+            assert await warehouse.roll_up_pending() == 2
+            assert await warehouse.roll_up_pending() == 0
+            assert totals(await warehouse.rollup_summary(days=days)) == expected
+        finally:
+            await session.close()
+            await Tortoise.close_connections()
+
+    asyncio.run(main())
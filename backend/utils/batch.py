@@ -0,0 +1,181 @@
+from typing import Iterable
+
+import numpy as np
+
+from .data_models import Transaction, Filter
+from .db import epoch
+
+
+class TransactionBatch:
+    """Column oriented view of a list of transactions.
+
+    amounts are kept in kobo, transaction types are interned into small integer codes indexing `types`,
+    `time` holds epoch seconds and `clock` the local microseconds since midnight used by the time of day filters.
+    """
+    __slots__ = ('agent_id', 'amount', 'trans_type', 'time', 'clock', 'types', 'names')
+
+    def __init__(self, *, agent_id: np.ndarray, amount: np.ndarray, trans_type: np.ndarray, time: np.ndarray, clock: np.ndarray,
+                 types: list[str], names: dict[int, str]):
+        self.agent_id = agent_id
+        self.amount = amount
+        self.trans_type = trans_type
+        self.time = time
+        self.clock = clock
+        self.types = types
+        self.names = names
+
+    def __len__(self):
+        return len(self.agent_id)
+
+    @classmethod
+    def empty(cls, types: list[str] | None = None) -> 'TransactionBatch':
+        return cls(agent_id=np.empty(0, dtype=np.int64), amount=np.empty(0, dtype=np.int64), trans_type=np.empty(0, dtype=np.int32),
+                   time=np.empty(0, dtype=np.float64), clock=np.empty(0, dtype=np.int64), types=types or [], names={})
+
+    @classmethod
+    def from_transactions(cls, transactions: Iterable[Transaction]) -> 'TransactionBatch':
+        codes: dict[str, int] = {}
+        names: dict[int, str] = {}
+        agent_id, amount, trans_type, time, clock = [], [], [], [], []
+        for trans in transactions:
+            agent_id.append(trans.agent_id)
+            amount.append(trans.amount)
+            trans_type.append(codes.setdefault(trans.trans_type, len(codes)))
+            time.append(epoch(trans.time))
+            clock.append((trans.time.hour * 3600 + trans.time.minute * 60 + trans.time.second) * 1_000_000 + trans.time.microsecond)
+            if trans.agent_id not in names:
+                names[trans.agent_id] = trans.business_name
+
+        return cls(agent_id=np.array(agent_id, dtype=np.int64), amount=np.array(amount, dtype=np.int64),
+                   trans_type=np.array(trans_type, dtype=np.int32), time=np.array(time, dtype=np.float64),
+                   clock=np.array(clock, dtype=np.int64), types=list(codes), names=names)
+
+    def select(self, mask: np.ndarray) -> 'TransactionBatch':
+        if mask.all():
+            return self
+        agent_id = self.agent_id[mask]
+        names = {key: self.names[key] for key in np.unique(agent_id).tolist()}
+        return TransactionBatch(agent_id=agent_id, amount=self.amount[mask], trans_type=self.trans_type[mask], time=self.time[mask],
+                                clock=self.clock[mask], types=self.types, names=names)
+
+    def summarize(self) -> 'AgentSummaries':
+        agents, index = np.unique(self.agent_id, return_inverse=True)
+        size, width = len(agents), len(self.types)
+        amount = np.bincount(index, weights=self.amount, minlength=size).astype(np.int64)
+        counts = np.bincount(index * width + self.trans_type, minlength=size * width).reshape(size, width)
+        first = np.full(size, np.inf)
+        last = np.full(size, -np.inf)
+        np.minimum.at(first, index, self.time)
+        np.maximum.at(last, index, self.time)
+        return AgentSummaries(agent_id=agents, amount=amount, counts=counts, first=first, last=last, types=self.types,
+                              names={key: self.names[key] for key in agents.tolist()})
+
+
+class AgentSummaries:
+    """Per agent totals for a batch: one row per agent_id, `counts` has one column per transaction type"""
+    __slots__ = ('agent_id', 'amount', 'counts', 'first', 'last', 'types', 'names')
+
+    def __init__(self, *, agent_id: np.ndarray, amount: np.ndarray, counts: np.ndarray, first: np.ndarray, last: np.ndarray, types: list[str],
+                 names: dict[int, str]):
+        self.agent_id = agent_id
+        self.amount = amount
+        self.counts = counts
+        self.first = first
+        self.last = last
+        self.types = types
+        self.names = names
+
+    def __len__(self):
+        return len(self.agent_id)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> 'AgentSummaries':
+        """Build from pre-aggregated (agent_id, trans_type) rows such as the daily rollups"""
+        rows = list(rows)
+        index: dict[int, int] = {}
+        codes: dict[str, int] = {}
+        names: dict[int, str] = {}
+        for row in rows:
+            index.setdefault(row['agent_id'], len(index))
+            codes.setdefault(row['trans_type'], len(codes))
+            names.setdefault(row['agent_id'], row['business_name'])
+
+        amount = np.zeros(len(index), dtype=np.int64)
+        counts = np.zeros((len(index), len(codes)), dtype=np.int64)
+        first = np.full(len(index), np.inf)
+        last = np.full(len(index), -np.inf)
+        for row in rows:
+            i, j = index[row['agent_id']], codes[row['trans_type']]
+            counts[i, j] += int(row['count'])
+            amount[i] += int(row['amount'])
+            first[i] = min(first[i], epoch(row['first_time']))
+            last[i] = max(last[i], epoch(row['last_time']))
+        return cls(agent_id=np.fromiter(index, dtype=np.int64, count=len(index)), amount=amount, counts=counts, first=first, last=last,
+                   types=list(codes), names=names)
+
+    def ranking(self) -> np.ndarray:
+        """agent_ids ordered by amount, highest first"""
+        return self.agent_id[np.argsort(-self.amount, kind='stable')]
+
+    def below(self, target: float) -> np.ndarray:
+        """agent_ids whose total amount in naira is below target"""
+        return self.agent_id[self.amount / 100 < target]
+
+    def rows(self) -> Iterable[dict]:
+        for i, agent_id in enumerate(self.agent_id.tolist()):
+            counts = {self.types[j]: int(count) for j, count in enumerate(self.counts[i].tolist()) if count}
+            yield {'agent_id': agent_id, 'business_name': self.names[agent_id], 'amount': int(self.amount[i]) / 100, **counts}
+
+
+class SummaryAccumulator:
+    """Running per agent totals, batches are folded in as they arrive and dropped, so memory grows with agents not transactions"""
+
+    def __init__(self, *, filter: Filter | None = None, capacity: int = 64):
+        self.filter = filter or Filter()
+        self.index: dict[int, int] = {}
+        self.codes: dict[str, int] = {}
+        self.names: dict[int, str] = {}
+        self.amount = np.zeros(capacity, dtype=np.int64)
+        self.counts = np.zeros((capacity, 8), dtype=np.int64)
+        self.first = np.full(capacity, np.inf)
+        self.last = np.full(capacity, -np.inf)
+        self.rows = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def grow(self):
+        size, width = len(self.index), len(self.codes)
+        capacity, columns = self.counts.shape
+        if size > capacity:
+            extra = max(size, capacity * 2) - capacity
+            self.amount = np.concatenate([self.amount, np.zeros(extra, dtype=np.int64)])
+            self.first = np.concatenate([self.first, np.full(extra, np.inf)])
+            self.last = np.concatenate([self.last, np.full(extra, -np.inf)])
+            self.counts = np.concatenate([self.counts, np.zeros((extra, columns), dtype=np.int64)])
+        if width > columns:
+            self.counts = np.concatenate([self.counts, np.zeros((len(self.counts), max(width, columns * 2) - columns), dtype=np.int64)], axis=1)
+
+    def fold(self, batch: TransactionBatch):
+        batch = batch.select(self.filter.mask(batch))
+        if len(batch):
+            self.merge(batch.summarize())
+
+    def merge(self, summary: AgentSummaries):
+        """Add already summarised totals, the accumulator's filter is not applied to them"""
+        self.rows += int(summary.counts.sum())
+        codes = np.array([self.codes.setdefault(name, len(self.codes)) for name in summary.types], dtype=np.int64)
+        rows = np.array([self.index.setdefault(agent_id, len(self.index)) for agent_id in summary.agent_id.tolist()], dtype=np.int64)
+        for agent_id, name in summary.names.items():
+            self.names.setdefault(agent_id, name)
+        self.grow()
+        self.amount[rows] += summary.amount
+        self.counts[np.ix_(rows, codes)] += summary.counts
+        self.first[rows] = np.minimum(self.first[rows], summary.first)
+        self.last[rows] = np.maximum(self.last[rows], summary.last)
+
+    def result(self) -> AgentSummaries:
+        size, width = len(self.index), len(self.codes)
+        return AgentSummaries(agent_id=np.fromiter(self.index, dtype=np.int64, count=size), amount=self.amount[:size].copy(),
+                              counts=self.counts[:size, :width].copy(), first=self.first[:size].copy(), last=self.last[:size].copy(),
+                              types=list(self.codes), names=dict(self.names))
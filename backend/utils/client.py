@@ -1,37 +1,68 @@
 import asyncio
+from collections import deque
 from json import JSONDecodeError
 import random
 import datetime
-from typing import Iterable
+import time
+from typing import Iterable, AsyncIterator
 from logging import getLogger
 
-from httpx import AsyncClient, RequestError, Headers
+from httpx import AsyncClient, RequestError, Headers, Response
 
 from .env import env
+from .sessions import sessions
+from .limiter import limits
+from .metrics import upstream_latency, upstream_in_flight
+from .timings import stage, count
+from . import progress
 from .task_queue import TaskQueue
 from .data_models import Agent, Auth, Transaction, Profile
 
 logger = getLogger()
 
 
+class UpstreamBusy(Exception):
+    """The upstream API throttled or failed a request that is worth retrying"""
+
+
 class ClientTransaction:
-    def __init__(self, auth: Auth):
+    def __init__(self, auth: Auth, client: AsyncClient | None = None):
         self.auth = auth
         self.headers = Headers(
             {"authority": env.AUTHORITY, "origin": env.ORIGIN, "referer": env.REFERER, "client-type": "WEB", "client-version": "0.0.0"})
         self.params = {"pageNumber": 1, "pageSize": 1000}
         self.url = env.API_URL
-        self.client = AsyncClient(base_url=self.url, headers=self.headers)
+        self.retries = int(env.API_RETRIES or 3)
+        self._client = client
+
+    @property
+    def client(self) -> AsyncClient:
+        return self._client or sessions.client
 
     @property
     def is_auth(self):
-        return self.auth.status
+        return self.auth.status and self.auth.expires > time.time()
+
+    def use_token(self, token: str, expires: float):
+        self.headers['Authorization'] = f"Bearer {token}"
+        self.auth.status = True
+        self.auth.token = f"Bearer {token}"
+        self.auth.expires = expires
+
+    async def authenticate(self, trie=0, force=False):
+        if not force and self.is_auth:
+            return True
+
+        if not force and (cached := await sessions.get_token(self.auth.username)):
+            self.use_token(*cached)
+            return True
 
-    async def authenticate(self, trie=0):
         try:
             data = {"username": self.auth.username, "password": self.auth.password, "secret": self.auth.password,
                     **self.device}
-            res = await self.client.post("/auth/tokens", json=data)
+            res = await self.request("POST", "/auth/tokens", json=data)
+            if res.status_code == 429 or res.status_code >= 500:
+                raise UpstreamBusy(f"Upstream responded with {res.status_code}")
             res = res.json()
 
             if not isinstance(res, dict):
@@ -42,16 +73,14 @@ class ClientTransaction:
                 return False
 
             token = res['tokenData']['access_token']
-            self.client.headers['Authorization'] = self.headers['Authorization'] = f"Bearer {token}"
-            self.auth.status = True
-            self.auth.token = f"Bearer {token}"
+            expires = await sessions.set_token(self.auth.username, token, float(res['tokenData'].get('expires_in') or 3600))
+            self.use_token(token, expires)
             return True
 
-        except (RequestError, TypeError, JSONDecodeError) as err:
-            if trie > 2:
+        except (RequestError, TypeError, JSONDecodeError, UpstreamBusy) as err:
+            if trie < self.retries:
                 await asyncio.sleep(self.backoff(trie=trie))
-                trie = trie + 1
-                await self.authenticate(trie=trie)
+                return await self.authenticate(trie=trie + 1, force=force)
             logger.error(f"{err}: Unable to authenticate")
             return False
 
@@ -59,6 +88,12 @@ class ClientTransaction:
             logger.error(f"{err}: Unable to authenticate")
             return False
 
+    async def renew(self) -> bool:
+        """Drop the cached token after the upstream rejected it and log in again"""
+        self.auth.status = False
+        await sessions.drop_token(self.auth.username)
+        return await self.authenticate(force=True)
+
     @property
     def device(self) -> dict:
         dui = random.randint(68000000, 70000000)
@@ -70,9 +105,29 @@ class ClientTransaction:
         }
 
     @staticmethod
-    def backoff(self, trie=0):
+    def backoff(trie=0):
         return min(64, 2 ** trie + (random.randint(1, 1000)) / 1000)
 
+    async def request(self, method: str, url: str, **kwargs) -> Response:
+        """Every upstream call goes through here so that it is rate limited and feeds the adaptive concurrency window"""
+        async with limits.slot(self.auth.username) as outcome:
+            upstream_in_flight.inc()
+            try:
+                with stage("authenticate" if url == "/auth/tokens" else "fetch"), \
+                        upstream_latency.time(method=method, endpoint=url, status="error") as labels:
+                    res = await self.client.request(method, url, headers=self.headers, **kwargs)
+                    labels['status'] = res.status_code
+            except RequestError:
+                outcome.ok = False
+                raise
+            finally:
+                upstream_in_flight.dec()
+            throttled = res.status_code == 429 or res.status_code >= 500
+            outcome.ok = False if throttled else True if res.status_code < 400 else None
+            retry_after = res.headers.get('retry-after', '')
+            outcome.retry_after = float(retry_after) if retry_after.replace('.', '', 1).isdigit() else 0
+            return res
+
     async def profile(self):
         try:
             res = await self.get_json(url="/profiles/aggregators")
@@ -84,23 +139,23 @@ class ClientTransaction:
         except Exception as err:
             logger.warning(err)
 
+    async def iter_consolidated_transactions(self, *, start_date: datetime.date, end_date: datetime.date, agent_id: int = 0,
+                                             concurrency: int = 0, ordered: bool = False) -> AsyncIterator[list[Transaction]]:
+        params = {**self.params, "startDate": start_date.strftime("%Y-%m-%d"), "endDate": end_date.strftime("%Y-%m-%d"), "amount": 0,
+                  "terminalId": 0, "hardwareTerminalId": 0, "agentId": agent_id or "", "status": "COMPLETED", "reference": ""}
+        url = "/aggregators/consolidated-transactions/"
+        async for page in self.pages(url=url, key="consolidatedTransactions", params=params, concurrency=concurrency, ordered=ordered):
+            with stage("parse"):
+                transactions = Transaction.from_page(page)
+            count("records", len(page))
+            yield transactions
+
     async def get_consolidated_transactions(self, *, start_date: datetime.date, end_date: datetime.date, agent_id: int = 0)\
             -> list[Transaction] | None:
         try:
-            params = {**self.params, "startDate": start_date.strftime("%Y-%m-%d"), "endDate": end_date.strftime("%Y-%m-%d"), "amount": 0,
-                      "terminalId": 0, "hardwareTerminalId": 0, "agentId": agent_id or "", "status": "COMPLETED", "reference": ""}
-            url = "/aggregators/consolidated-transactions/"
-            res = await self.get_json(url=url, params=params)
-            consolidated_transactions = res.get("consolidatedTransactions", [])
-            transactions = [Transaction.create(trans) for trans in consolidated_transactions if trans['status'] == "COMPLETED" and
-                            not trans['reversed'] and not trans['shouldBeReversed']]
-
-            if pages := res.get('otherPages', []):
-                for page in pages:
-                    trans = page.get("consolidatedTransactions", [])
-                    transactions.extend(Transaction.create(tran) for tran in trans if tran['status'] == "COMPLETED" and not tran['reversed'] and not
-                    tran['shouldBeReversed'])
-
+            transactions = []
+            async for page in self.iter_consolidated_transactions(start_date=start_date, end_date=end_date, agent_id=agent_id):
+                transactions.extend(page)
             return transactions
         except Exception as err:
             logger.warning(err)
@@ -109,16 +164,10 @@ class ClientTransaction:
     async def get_agents(self) -> list[Agent] | None:
         try:
             params = {**self.params, "keyword": '', "status": ''}
-            url = "/agents"
-            data = await self.get_json(url=url, params=params)
-            agents = data['agents']
-
-            if pages := data.get('otherPages', []):
-                for page in pages:
-                    ags = page.get('agents', [])
-                    agents.extend(ags)
-
-            return [Agent(agent_id=agent['id'], name=agent['businessName'].title(), mobile=agent['mobileNumber']) for agent in agents]
+            agents = []
+            async for page in self.pages(url="/agents", key='agents', params=params, ordered=True):
+                agents.extend(Agent(agent_id=agent['id'], name=agent['businessName'].title(), mobile=agent['mobileNumber']) for agent in page)
+            return agents
         except Exception as err:
             logger.warning(err)
 
@@ -127,16 +176,70 @@ class ClientTransaction:
             agents = agents or await self.get_agents()
             agent_transactions = []
             args = [{'start_date': start_date, 'end_date': end_date, 'agent_id': agent.agent_id} for agent in agents]
-            tasks = TaskQueue(self.get_consolidated_transactions, args=args, workers=len(agents))
+            tasks = TaskQueue(self.get_consolidated_transactions, args=args, workers=min(len(agents), int(env.API_CONCURRENCY or 8)))
             await tasks.run()
             [agent_transactions.extend(trans) for trans in tasks.results if trans]
             return agent_transactions
         except Exception as exe:
             logger.warning(exe)
 
-    async def get_json(self, *, url: str, trie=0, paginate=True, **kwargs):
+    async def pages(self, *, url: str, key: str, params: dict, concurrency: int = 0, ordered: bool = True) -> AsyncIterator[list[dict]]:
+        """Yield the records under `key` for every page of a paginated endpoint.
+
+        The first page is fetched alone to learn totalPages, then at most `concurrency` pages are in flight at any time.
+        With ordered=True pages are yielded in page order, otherwise as soon as they arrive.
+        Raises ValueError if any page can not be fetched, so partial results are never mistaken for complete ones.
+        """
+        def records(page: dict | None, number: int) -> list[dict]:
+            nonlocal fetched
+            if page is None:
+                raise ValueError(f"Unable to fetch page {number} of {url}")
+            fetched += 1
+            count("pages")
+            progress.update("fetching", page=fetched, pages=total)
+            return page.get(key, [])
+
+        def fetch(number: int) -> asyncio.Task:
+            task = asyncio.create_task(self.get_json(url=url, params={**params, 'pageNumber': number}))
+            task.number = number
+            return task
+
+        fetched = 0
+        first = await self.get_json(url=url, params={**params, 'pageNumber': 1})
+        total = first.get('totalPages', 1) if first else 1
+        yield records(first, 1)
+        del first
+
+        window = concurrency or int(env.API_CONCURRENCY or 8)
+        pending: deque[asyncio.Task] | set[asyncio.Task] = deque() if ordered else set()
+        number = 2
         try:
-            res = await self.client.get(url, **kwargs)
+            while pending or number <= total:
+                while number <= total and len(pending) < window:
+                    pending.append(fetch(number)) if ordered else pending.add(fetch(number))
+                    number += 1
+
+                if ordered:
+                    page = await pending[0]
+                    task = pending.popleft()
+                    yield records(page, task.number)
+                    continue
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield records(task.result(), task.number)
+        finally:
+            [task.cancel() for task in pending]
+
+    async def get_json(self, *, url: str, trie=0, renewed=False, **kwargs):
+        try:
+            res = await self.request("GET", url, **kwargs)
+            if res.status_code == 401 and not renewed and await self.renew():
+                return await self.get_json(url=url, trie=trie, renewed=True, **kwargs)
+
+            if res.status_code == 429 or res.status_code >= 500:
+                raise UpstreamBusy(f"Upstream responded with {res.status_code}")
+
             if res.status_code != 200:
                 raise ValueError("Unsuccessful Request")
 
@@ -145,24 +248,12 @@ class ClientTransaction:
                 raise TypeError("Invalid Response")
 
             if res.get("responseCode") == "20000":
-
-                if (pages := res['totalPages']) > 1 and paginate:
-                    tasks = TaskQueue(self.get_json, workers=pages)
-                    arg = {'url': url, 'trie': 0, 'paginate': False}
-                    for i in range(2, pages + 1):
-                        kwargs['params']['pageNumber'] = i
-                        arg |= kwargs
-                        tasks.add(arg)
-                        await tasks.run()
-                    res['otherPages'] = [page for page in tasks.results if page is not None]
-
                 return res
 
-        except (TypeError, RequestError) as err:
-            if trie > 2:
+        except (TypeError, RequestError, JSONDecodeError, UpstreamBusy) as err:
+            if trie < self.retries:
                 await asyncio.sleep(self.backoff(trie=trie))
-                trie = trie + 1
-                return await self.get_json(url=url, trie=trie, **kwargs)
+                return await self.get_json(url=url, trie=trie + 1, renewed=renewed, **kwargs)
 
             logger.error(err)
 
@@ -170,4 +261,6 @@ class ClientTransaction:
             logger.error(err)
 
     async def close(self):
-        await self.client.aclose()
+        """Only a client passed in explicitly is closed, the shared pool stays warm for the next session"""
+        if self._client is not None:
+            await self._client.aclose()
@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 import os
 import asyncio
 import logging
+import threading
 from urllib.parse import quote as urlencode
 from typing import BinaryIO
 from pathlib import Path
@@ -9,11 +10,15 @@ from io import BufferedReader
 
 from pydantic import BaseModel, HttpUrl
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError, NoCredentialsError
 from .env import env
+from .timings import stage
 
 logger = logging.getLogger(__name__)
 
+MB = 2 ** 20
+
 
 class FileData(BaseModel):
     public_url: HttpUrl | str = ""
@@ -61,9 +66,24 @@ class S3(CloudUpload):
         self.aws_secret_access_key = aws_secret_access_key or env.AWS_SECRET_KEY
         self.bucket_name = bucket_name or env.S3_BUCKET_NAME
 
+    clients: dict[tuple[str, str], object] = {}
+    lock = threading.Lock()
+    transfer = TransferConfig(multipart_threshold=int(env.S3_MULTIPART_MB or 8) * MB, multipart_chunksize=int(env.S3_CHUNK_MB or 8) * MB,
+                              max_concurrency=int(env.S3_MAX_CONCURRENCY or 4))
+
+    def create_client(self):
+        """boto3 clients are thread safe and expensive to build, so one is kept per region and key for the life of the process"""
+        key = (self.region_name, self.aws_access_key_id)
+        with self.lock:
+            if (client := self.clients.get(key)) is None:
+                client = self.clients[key] = boto3.client('s3', region_name=self.region_name, aws_access_key_id=self.aws_access_key_id,
+                                                          aws_secret_access_key=self.aws_secret_access_key)
+        return client
+
     async def get_client(self):
-        return await asyncio.to_thread(boto3.client, 's3', region_name=self.region_name, aws_access_key_id=self.aws_access_key_id,
-                                       aws_secret_access_key=self.aws_secret_access_key)
+        if (client := self.clients.get((self.region_name, self.aws_access_key_id))) is not None:
+            return client
+        return await asyncio.to_thread(self.create_client)
 
     async def upload(self, name: str = ""):
         """"""
@@ -76,15 +96,23 @@ class S3(CloudUpload):
         try:
             s3 = client or await self.get_client()
             object_name, object_ = (name or file.name, file.open(mode='rb')) if isinstance(file, Path) else (name or file.name.rsplit('/')[-1], file)
-            await asyncio.to_thread(s3.upload_fileobj, object_, self.bucket_name, object_name, ExtraArgs=self.extra_args)
+            object_.seek(0)
+            with stage("upload"):
+                await asyncio.to_thread(s3.upload_fileobj, object_, self.bucket_name, object_name, ExtraArgs=self.extra_args,
+                                        Config=self.transfer)
             url = f"https://{self.bucket_name}.s3.{self.region_name}.amazonaws.com/{urlencode(object_name.encode('utf8'))}"
             return FileData(public_url=url)
         except (NoCredentialsError, ClientError, Exception) as err:
             logger.error(err)
             return FileData(status=False)
 
-    async def multi_upload(self, *args, **kwargs):
+    async def multi_upload(self, *args, concurrency: int = 0, **kwargs):
         client = await self.get_client()
-        tasks = [asyncio.create_task(self._upload_file(file=file, client=client)) for file in self.files]
-        self.response = await asyncio.gather(*tasks)
+        semaphore = asyncio.Semaphore(concurrency or int(env.S3_UPLOADS or 4))
+
+        async def upload(file):
+            async with semaphore:
+                return await self._upload_file(file=file, client=client)
+
+        self.response = await asyncio.gather(*(upload(file) for file in self.files))
         return self.response
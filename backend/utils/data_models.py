@@ -1,7 +1,10 @@
+import sys
 from dataclasses import dataclass, asdict
 from datetime import datetime, time
-from functools import cache
+from functools import lru_cache
+from typing import Iterable
 
+import numpy as np
 from pydantic import BaseModel, Field
 
 
@@ -18,8 +21,29 @@ class Agent(BaseModel):
         return self.agent_id
 
 
-@dataclass
+def parse_time(value: str) -> datetime:
+    """fromisoformat is an order of magnitude faster than strptime, the latter only handles offsets older pythons reject like +0100"""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z")
+
+
+@lru_cache(maxsize=65536)
+def normalize_name(name: str) -> str:
+    """Title cased and interned so every transaction of an agent shares one string"""
+    return sys.intern(name.title())
+
+
+@dataclass(frozen=True, slots=True)
 class Transaction:
+    """A completed upstream transaction.
+
+    Instances are immutable and slotted, business_name and trans_type are interned and agent_id is shared by all the
+    transactions of an agent in a page. A parsed record costs about 200 bytes on 64-bit CPython 3.11: 72 for the instance,
+    48 for the datetime plus 72 for the timezone fromisoformat gives it and 28 for amount, so a million transactions
+    take about 200MB (checked in tests/test_data_models.py).
+    """
     business_name: str
     time: datetime
     trans_type: str
@@ -27,27 +51,40 @@ class Transaction:
     amount: int = 0
 
     @property
-    @cache
     def dict(self) -> dict:
-        return asdict(self)
+        return {'business_name': self.business_name, 'time': self.time, 'trans_type': self.trans_type, 'agent_id': self.agent_id,
+                'amount': self.amount}
 
     @property
-    @cache
     def to_json(self) -> dict:
-        obj = self.dict.copy()
-        obj['time'] = str(obj['time'])
-        return obj
+        return {'business_name': self.business_name, 'time': str(self.time), 'trans_type': self.trans_type, 'agent_id': self.agent_id,
+                'amount': self.amount}
 
     @classmethod
     def create(cls, trans: dict) -> 'Transaction':
-        name = trans['agent']['businessName'].title()
-        time = datetime.strptime(trans['createdOn'], "%Y-%m-%dT%H:%M:%S.%f%z")
-        return cls(business_name=name, time=time, trans_type=trans['transactionType'], amount=trans['amount'], agent_id=trans['agent']['id'])
+        agent = trans['agent']
+        return cls(business_name=normalize_name(agent['businessName']), time=parse_time(trans['createdOn']),
+                   trans_type=sys.intern(trans['transactionType']), amount=trans['amount'], agent_id=agent['id'])
+
+    @classmethod
+    def from_page(cls, records: Iterable[dict]) -> list['Transaction']:
+        """Parse a page of raw upstream records keeping only completed, unreversed ones"""
+        agents: dict[int, tuple[int, str]] = {}
+        intern = sys.intern
+        transactions = []
+        append = transactions.append
+        for trans in records:
+            if trans['status'] != "COMPLETED" or trans['reversed'] or trans['shouldBeReversed']:
+                continue
+            agent = trans['agent']
+            if (known := agents.get(agent['id'])) is None:
+                known = agents[agent['id']] = (agent['id'], normalize_name(agent['businessName']))
+            append(cls(known[1], parse_time(trans['createdOn']), intern(trans['transactionType']), known[0], trans['amount']))
+        return transactions
 
     @classmethod
     def from_json(cls, trans: dict) -> 'Transaction':
-        trans['time'] = datetime.strptime(trans['time'], "%Y-%m-%d %H:%M:%S+%f:00")
-        return cls(**trans)
+        return cls(**{**trans, 'time': parse_time(trans['time'])})
 
 
 @dataclass
@@ -56,6 +93,7 @@ class Auth:
     username: str
     token: str = ""
     status: bool = False
+    expires: float = 0
 
 
 @dataclass
@@ -72,6 +110,9 @@ class Filter:
     def __call__(self, *args, **kwargs) -> bool:
         return True
 
+    def mask(self, batch) -> np.ndarray:
+        return np.ones(len(batch), dtype=bool)
+
 
 class TimeFilter(Filter):
     def __init__(self, start: time = time(hour=0, minute=0, second=0), end: time = time(hour=23, minute=59, second=59)):
@@ -81,6 +122,13 @@ class TimeFilter(Filter):
     def __call__(self, *, trans: Transaction) -> bool:
         return self.start <= trans.time.time() <= self.end
 
+    @staticmethod
+    def micros(value: time) -> int:
+        return (value.hour * 3600 + value.minute * 60 + value.second) * 1_000_000 + value.microsecond
+
+    def mask(self, batch) -> np.ndarray:
+        return (batch.clock >= self.micros(self.start)) & (batch.clock <= self.micros(self.end))
+
 
 class AgentFilter(Filter):
     def __init__(self, agents: list[int]):
@@ -89,6 +137,9 @@ class AgentFilter(Filter):
     def __call__(self, *, trans: Transaction) -> bool:
         return trans.agent_id in self.agents
 
+    def mask(self, batch) -> np.ndarray:
+        return np.isin(batch.agent_id, np.asarray(self.agents, dtype=np.int64))
+
 
 MorningFilter = TimeFilter(start=time(hour=0, minute=0, second=0), end=time(hour=11, minute=59, second=59))
 
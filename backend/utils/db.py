@@ -1,3 +1,6 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
 from .env import env
 
 TORTOISE_ORM = {
@@ -23,3 +26,16 @@ TORTOISE_ORM = {
     "use_tz": False,
     "timezone": env.DB_TIMEZONE
 }
+
+# Tortoise runs with use_tz off, so DatetimeFields hold naive wall times which it reads back as times in this zone
+TIMEZONE = ZoneInfo(env.DB_TIMEZONE or "UTC")
+
+
+def db_time(value: datetime) -> datetime:
+    """value as a naive wall time in TIMEZONE, naive values are taken to be in it already"""
+    return value.astimezone(TIMEZONE).replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+def epoch(value: datetime) -> float:
+    """Epoch seconds of value, naive values are taken to be wall times in TIMEZONE rather than the host's zone"""
+    return (value if value.tzinfo is not None else value.replace(tzinfo=TIMEZONE)).timestamp()
@@ -5,6 +5,7 @@ from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from pydantic import EmailStr, BaseModel, HttpUrl
 
 from .env import env
+from .timings import stage
 
 logger = getLogger()
 
@@ -43,7 +44,8 @@ class Email(BaseModel):
     async def send(self) -> bool:
         try:
             msg = self.create_message()
-            await self.fast_mail.send_message(msg)
+            with stage("email"):
+                await self.fast_mail.send_message(msg)
             return True
         except Exception as exe:
             logger.warning(f"{exe}: Unable to send Email")
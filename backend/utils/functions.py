@@ -1,5 +1,5 @@
 from logging import getLogger
-from datetime import date
+from datetime import date, timedelta
 import asyncio
 
 from tortoise import Tortoise
@@ -7,7 +7,13 @@ from tortoise import Tortoise
 from models.aggregator import Aggregator, Agent
 from models.tables_orm import AggregatorORM, ReportORM
 from .task_queue import TaskQueue
+from .loop import run_cpu
+from .timings import ReportTimings
+from .progress import Progress
 from .db import TORTOISE_ORM
+from .env import env
+from .sessions import sessions
+from .redis_client import close_redis
 
 logger = getLogger()
 
@@ -21,31 +27,75 @@ async def connect():
     await Tortoise.init(config=TORTOISE_ORM)
 
 
+async def disconnect():
+    await sessions.close()
+    await close_redis()
+    await Tortoise.close_connections()
+
+
 async def generate_reports(*, start_date: date | None = None, end_date: date | None = None, aggregators: list[Aggregator] | None = None):
     aggregators = aggregators or await get_aggregators()
     args = [{'aggregator': aggregator, 'start_date': start_date, 'end_date': end_date} for aggregator in aggregators]
-    tasks = TaskQueue(coroutine=generate_report, args=args)
+    tasks = TaskQueue(coroutine=generate_report, args=args, workers=int(env.REPORT_CONCURRENCY or 4))
+    await tasks.run()
+
+
+async def close_days(*, days: int = 2):
+    """Nightly: sync the last few days of every aggregator so that closed days get rolled up"""
+    end_date = date.today() - timedelta(days=1)
+    start_date = end_date - timedelta(days=days - 1)
+    aggregators = await get_aggregators()
+    args = [{'aggregator': aggregator, 'start_date': start_date, 'end_date': end_date} for aggregator in aggregators]
+    tasks = TaskQueue(coroutine=close_aggregator_days, args=args, workers=int(env.REPORT_CONCURRENCY or 4))
     await tasks.run()
 
 
+async def close_aggregator_days(*, aggregator: Aggregator, start_date: date, end_date: date):
+    await aggregator.close_days(start_date=start_date, end_date=end_date)
+
+
 async def get_report(*, aggregator: Aggregator, start_date: date | None = None, end_date: date | None = None, target: None | float = None,
-                          agents: list[Agent] | None = None, title: str = ""):
+                          agents: list[Agent] | None = None, title: str = "", task_id: str = ""):
     try:
-        report = await generate_report(aggregator=aggregator, start_date=start_date, end_date=end_date, target=target, agents=agents, title=title)
-        await aggregator.send_report(url=report.url) if report else ...
+        await generate_report(aggregator=aggregator, start_date=start_date, end_date=end_date, target=target, agents=agents, title=title,
+                              send=True, task_id=task_id)
     except Exception as err:
         logger.error(err)
 
 
 async def generate_report(*, aggregator: Aggregator, start_date: date | None = None, end_date: date | None = None, target: None | float = None,
-                          agents: list[Agent] | None = None, title: str = "") -> ReportORM:
-    try:
-        trans = await aggregator.get_transactions(start_date=start_date, end_date=end_date, target=target, agents=agents, title=title)
-        file = await aggregator.get_pdf(transactions=trans)
-        res = await aggregator.upload_to_cloud(file=file)
-        return await aggregator.save_report(**res)
-    except Exception as err:
-        logger.error(f"{err}: Unable to generate report")
+                          agents: list[Agent] | None = None, title: str = "", send: bool = False, task_id: str = "") -> ReportORM:
+    """Build, upload and save a report, emailing it when send is True. Every run's stage timings are saved with it and,
+    given the id of the celery task running it, its progress is published for the web tier to stream"""
+    report, status = None, "failed"
+    progress = Progress(username=aggregator.username, task_id=task_id)
+    with ReportTimings().activate() as timings, progress.activate():
+        try:
+            progress.update("started")
+            start_date = start_date or date.today()
+            end_date = end_date or date.today()
+            trans = await aggregator.get_transactions(start_date=start_date, end_date=end_date, target=target, agents=agents, title=title)
+            digest = await run_cpu(trans.digest, start_date=start_date, end_date=end_date)
+            if (report := await aggregator.cached_report(digest=digest)) is not None:
+                status = "cached"
+            else:
+                progress.update("rendering")
+                file = await aggregator.get_pdf(transactions=trans)
+                timings.count("pdf_bytes", file.getbuffer().nbytes)
+                progress.update("uploading")
+                res = await aggregator.upload_to_cloud(file=file)
+                report = await aggregator.save_report(**res, digest=digest, size=file.getbuffer().nbytes)
+                await aggregator.evict_reports()
+                status = "ok" if report else status
+            if send and report:
+                progress.update("emailing")
+                await aggregator.send_report(url=report.url)
+        except Exception as err:
+            logger.error(f"{err}: Unable to generate report")
+    progress.update("done", url=report.url, cached=status == "cached") if report else progress.update("failed", message="Unable to generate report")
+    await aggregator.save_run(timings=timings, status=status, report=report)
+    await progress.close()
+    return report
 
 
 async def run(*coroutines):
@@ -0,0 +1,121 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from .env import env
+
+
+@dataclass
+class Outcome:
+    """What happened to a request: ok=True grows the window, ok=False shrinks it, None leaves it alone"""
+    ok: bool | None = None
+    retry_after: float = 0
+
+
+class AdaptiveLimiter:
+    """Token bucket for request rate plus an AIMD window for concurrency.
+
+    The window grows by one slot per window of successful requests and is halved on a throttled, failed or timed out request.
+    """
+
+    def __init__(self, *, rate: float, burst: int, initial: int = 4, minimum: int = 1, maximum: int = 32, decrease: float = 0.5):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def window(self) -> int:
+        return max(self.minimum, int(self.limit))
+
+    def take(self) -> float:
+        """Take a token, or return how long to wait for the next one"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while self.in_flight >= self.window:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self.waiters.remove(waiter) if waiter in self.waiters else self.wake()
+                raise
+        self.in_flight += 1
+
+        try:
+            while (delay := self.take()) > 0:
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.release(Outcome())
+            raise
+
+    def release(self, outcome: Outcome):
+        self.in_flight -= 1
+        if outcome.ok:
+            self.limit = min(self.maximum, self.limit + 1 / self.window)
+        elif outcome.ok is False:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+        if outcome.retry_after:
+            self.pause(outcome.retry_after)
+        self.wake()
+
+    def wake(self):
+        free = self.window - self.in_flight
+        while free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class RateLimits:
+    """A global limiter shared by every request plus one limiter per aggregator"""
+
+    def __init__(self):
+        self.limiters: dict[str, AdaptiveLimiter] = {}
+        self.all = AdaptiveLimiter(rate=float(env.API_GLOBAL_RATE or 50), burst=int(env.API_GLOBAL_BURST or 50), initial=16,
+                                   maximum=int(env.API_GLOBAL_CONCURRENCY or 64))
+
+    def get(self, key: str) -> AdaptiveLimiter:
+        if (limiter := self.limiters.get(key)) is None:
+            limiter = self.limiters[key] = AdaptiveLimiter(rate=float(env.API_RATE or 10), burst=int(env.API_BURST or 10),
+                                                           initial=int(env.API_CONCURRENCY or 8), maximum=int(env.API_MAX_CONCURRENCY or 32))
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, key: str) -> AsyncIterator[Outcome]:
+        limiters = (self.get(key), self.all)
+        acquired = []
+        outcome = Outcome()
+        try:
+            for limiter in limiters:
+                await limiter.acquire()
+                acquired.append(limiter)
+            yield outcome
+        finally:
+            [limiter.release(outcome) for limiter in acquired]
+
+
+limits = RateLimits()
@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+from typing import Awaitable, Callable, Coroutine
+
+from .env import env
+
+logger = getLogger()
+
+cpu = ThreadPoolExecutor(max_workers=int(env.CPU_WORKERS or min(4, os.cpu_count() or 1)), thread_name_prefix="cpu")
+
+
+async def run_cpu(func: Callable, *args, **kwargs):
+    """Run a CPU bound call (aggregation, report content, digests) on the cpu executor instead of the event loop.
+
+    numpy releases the GIL, so the loop keeps serving other requests while they run. Calls that take well under a millisecond,
+    like signing a JWT, are cheaper inline than queued behind them.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(cpu, partial(context.run, func, *args, **kwargs))
+
+
+class LoopMonitor:
+    """Watchdog thread that logs where the event loop is stuck whenever one iteration runs longer than `threshold` seconds.
+
+    The loop stamps a heartbeat every `interval` seconds, when the stamp is older than the threshold the watchdog logs the
+    stack of the loop's thread once per stall. `stalls` and `longest` keep track of what was seen.
+    """
+
+    def __init__(self, *, threshold: float = 0.1, interval: float | None = None):
+        self.threshold = threshold
+        self.interval = interval or threshold / 4
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread_id = 0
+        self.beat = 0.0
+        self.stalls = 0
+        self.longest = 0.0
+        self.stopped = threading.Event()
+        self.watchdog: threading.Thread | None = None
+
+    def tick(self):
+        now = time.monotonic()
+        self.longest = max(self.longest, now - self.beat - self.interval)
+        self.beat = now
+        if not self.stopped.is_set():
+            self.loop.call_later(self.interval, self.tick)
+
+    def start(self):
+        """Start watching the running loop, must be called from the loop's thread"""
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.stopped.clear()
+        self.loop.call_soon(self.tick)
+        self.watchdog = threading.Thread(target=self.watch, name="loop-monitor", daemon=True)
+        self.watchdog.start()
+
+    def watch(self):
+        reported = 0.0
+        while not self.stopped.wait(self.interval):
+            beat = self.beat
+            if (blocked := time.monotonic() - beat) > self.threshold and beat != reported:
+                reported = beat
+                self.stalls += 1
+                frame = sys._current_frames().get(self.thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else ""
+                logger.warning(f"Event loop blocked for more than {blocked * 1000:.0f}ms in:\n{stack}")
+
+    def stop(self):
+        self.stopped.set()
+        self.watchdog.join() if self.watchdog is not None else ...
+
+
+monitor = LoopMonitor(threshold=float(env.LOOP_MONITOR_MS or 100) / 1000)
+
+
+class LoopThread:
+    """A long lived event loop running in a background thread.
+
+    Synchronous callers (celery task threads) submit coroutines to it, so database pools and http sessions opened by `startup`
+    stay warm across tasks and many I/O bound tasks share the one loop. The loop only counts as running once `startup` has
+    finished, callers that arrive while it runs wait for it, and a startup that fails stops the loop again so the next call retries.
+    """
+
+    def __init__(self, *, startup: Callable[[], Awaitable] | None = None, shutdown: Callable[[], Awaitable] | None = None):
+        self.startup = startup
+        self.shutdown = shutdown
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread: threading.Thread | None = None
+        self.pid = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        """A loop inherited through fork has no thread behind it, so it only counts in the process that started it"""
+        return self.ready.is_set() and self.loop is not None and self.pid == os.getpid() and self.thread.is_alive()
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.ready.clear()
+            self.loop = asyncio.new_event_loop()
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="worker-loop", daemon=True)
+            self.thread.start()
+            try:
+                if self.startup is not None:
+                    asyncio.run_coroutine_threadsafe(self.startup(), self.loop).result()
+            except BaseException:
+                self.close()
+                raise
+            self.ready.set()
+
+    def submit(self, coro: Coroutine) -> Future:
+        try:
+            self.start() if not self.running else ...
+        except BaseException:
+            coro.close()
+            raise
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: float | None = None):
+        return self.submit(coro).result(timeout)
+
+    def stop(self, timeout: float = 30):
+        with self.lock:
+            if not self.running:
+                return
+            try:
+                if self.shutdown is not None:
+                    asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(timeout)
+            except Exception as err:
+                logger.error(f"{err}: Unable to shutdown worker loop cleanly")
+            finally:
+                self.close(timeout)
+
+    def close(self, timeout: float = 30):
+        """Stop the loop's thread and drop the loop, the lock must be held"""
+        self.ready.clear()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.loop.close()
+        self.loop = self.thread = None
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from .env import env
+
+_missing = object()
+
+
+class LRU:
+    """A bounded mapping that drops the least recently used entry once it holds `maxsize` entries.
+
+    Safe to share between threads, views are built on the cpu executor while the loop reads them.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.data: OrderedDict[Hashable, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+    def put(self, key: Hashable, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class lazy:
+    """A property computed on first access and kept on the instance until it is invalidated.
+
+    Values live in the instance's `_memo` dict so they go away with the instance. With shared=True the value is also kept in
+    the bounded `lazy.shared` LRU under the instance's `memo_key()`, so instances with identical content compute it once.
+    """
+    shared = LRU(maxsize=int(env.MEMO_CACHE_SIZE or 32))
+
+    def __init__(self, func: Callable = None, *, shared: bool = False):
+        self.func = func
+        self.share = shared
+        self.name = func.__name__ if func else ""
+        self.__doc__ = getattr(func, '__doc__', None)
+
+    def __call__(self, func: Callable) -> 'lazy':
+        return type(self)(func, shared=self.share)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        memo = instance._memo
+        if (value := memo.get(self.name, _missing)) is not _missing:
+            return value
+
+        key = (owner.__qualname__, self.name, instance.memo_key()) if self.share else None
+        if key is None or (value := self.shared.get(key, _missing)) is _missing:
+            value = self.func(instance)
+            self.shared.put(key, value) if key is not None else ...
+        memo[self.name] = value
+        return value
+
+
+def invalidate(instance, *names: str):
+    """Drop the memoized values of `names`, or all of them when no name is given"""
+    [instance._memo.pop(name, None) for name in names] if names else instance._memo.clear()
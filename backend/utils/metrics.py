@@ -0,0 +1,176 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from typing import Callable, Iterator
+
+logger = getLogger()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels_text(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    pairs.append(extra) if extra else ...
+    return f"{{{','.join(pairs)}}}" if pairs else ""
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """The sample lines of the metric in the text exposition format"""
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()])
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in list(self.values.items()):
+            yield f"{self.name}_total{labels_text(self.labels, key)} {value}"
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from `func` at scrape time when one is given"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), func: Callable[[], float] | None = None):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+        self.func = func
+
+    def set(self, value: float, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterator[str]:
+        if self.func is not None:
+            yield f"{self.name} {self.func()}"
+            return
+        for key, value in list(self.values.items()):
+            yield f"{self.name}{labels_text(self.labels, key)} {value}"
+
+
+class Histogram(Metric):
+    """Bucketed observations, an observation costs a bisect and three additions under an uncontended lock"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            if (counts := self.values.get(key)) is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[dict]:
+        """Observe the duration of the block, labels can still be added to the yielded dict inside the block"""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, counts in list(self.values.items()):
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                total += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{labels_text(self.labels, key, le)} {total}"
+            yield f"{self.name}_sum{labels_text(self.labels, key)} {counts[-1]}"
+            yield f"{self.name}_count{labels_text(self.labels, key)} {total}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = (), func: Callable[[], float] | None = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, func))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        """The registry in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """Expose the registry for scraping from a daemon thread, for processes without an HTTP app like the celery worker"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                ...
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Serving metrics on {host}:{port}")
+        return server
+
+
+registry = Registry()
+
+upstream_latency = registry.histogram("moniewatch_upstream_request_seconds", "Upstream API calls", ('method', 'endpoint', 'status'))
+upstream_in_flight = registry.gauge("moniewatch_upstream_in_flight", "Upstream requests holding a rate limiter slot")
+stage_latency = registry.histogram("moniewatch_stage_seconds", "Report pipeline stages", ('stage',))
+queue_depth = registry.gauge("moniewatch_task_queue_depth", "Tasks waiting in task queues", ('queue',))
+queue_running = registry.gauge("moniewatch_task_queue_running", "Tasks running in task queues", ('queue',))
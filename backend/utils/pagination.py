@@ -0,0 +1,57 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, date
+from functools import reduce
+from operator import or_
+from uuid import UUID
+
+from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
+
+from .env import env
+
+PAGE_SIZE = int(env.PAGE_SIZE or 50)
+MAX_PAGE_SIZE = int(env.MAX_PAGE_SIZE or 500)
+
+
+def encode_cursor(values: list) -> str:
+    """Opaque cursor holding the sort key of the last row of a page"""
+    def tag(value):
+        if isinstance(value, datetime):
+            return ['datetime', value.isoformat()]
+        if isinstance(value, date):
+            return ['date', value.isoformat()]
+        if isinstance(value, UUID):
+            return ['uuid', str(value)]
+        return ['', value]
+
+    return urlsafe_b64encode(json.dumps([tag(value) for value in values]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    types = {'datetime': datetime.fromisoformat, 'date': date.fromisoformat, 'uuid': UUID, '': lambda value: value}
+    try:
+        return [types[kind](value) for kind, value in json.loads(urlsafe_b64decode(cursor.encode()))]
+    except Exception as err:
+        raise ValueError(f"Invalid cursor {cursor}") from err
+
+
+async def keyset(query: QuerySet, *, order: tuple[str, ...], fields: tuple[str, ...], cursor: str | None = None, limit: int = PAGE_SIZE,
+                 descending: bool = False) -> tuple[list[dict], str | None]:
+    """One page of `query` sorted on the unique key `order`, starting after the row the cursor points at.
+
+    Seeks on the sort key instead of using OFFSET, so every page costs the same index range scan however deep it is.
+    Returns the rows and the cursor of the next page, which is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(order):
+            raise ValueError(f"Invalid cursor {cursor}")
+        op = 'lt' if descending else 'gt'
+        seek = [Q(**dict(zip(order[:i], values[:i])), **{f"{order[i]}__{op}": values[i]}) for i in range(len(order))]
+        query = query.filter(reduce(or_, seek))
+
+    rows = await query.order_by(*(f"-{key}" if descending else key for key in order)).limit(limit + 1).values(*dict.fromkeys(fields + order))
+    rows, more = rows[:limit], len(rows) > limit
+    return rows, encode_cursor([rows[-1][key] for key in order]) if more else None
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+from typing import AsyncIterator, Iterator
+
+from .env import env
+from .redis_client import get_redis
+
+logger = getLogger()
+
+PROGRESS_TTL = int(env.PROGRESS_TTL or 3600)
+FINAL = ('done', 'failed')
+
+current: ContextVar['Progress | None'] = ContextVar('report_progress', default=None)
+
+
+class Progress:
+    """Stage updates of one report task on a capped Redis stream that the web tier streams to the browser.
+
+    The stream keeps the history of the task for PROGRESS_TTL seconds, so a client that connects late or reconnects with the id
+    of the last event it saw still gets every update. `update` never waits on Redis: updates are queued and written in order
+    by one flusher task, and consecutive updates of the same stage that are still queued collapse into the latest one.
+    A Progress without a task_id publishes nothing.
+    """
+    prefix = "moniewatch:progress:"
+
+    def __init__(self, *, username: str, task_id: str = "", maxlen: int = 100):
+        self.key = f"{self.prefix}{username}:{task_id}" if task_id else ""
+        self.maxlen = maxlen
+        self.pending: list[dict] = []
+        self.flusher: asyncio.Task | None = None
+
+    def update(self, stage: str, **data):
+        if not self.key:
+            return
+        event = {'stage': stage, 'time': round(time.time(), 3), **data}
+        if self.pending and self.pending[-1]['stage'] == stage:
+            self.pending[-1] = event
+        else:
+            self.pending.append(event)
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        try:
+            while self.pending and (redis := get_redis()) is not None:
+                events, self.pending = self.pending, []
+                async with redis.pipeline(transaction=False) as pipe:
+                    for event in events:
+                        pipe.xadd(self.key, {'event': json.dumps(event)}, maxlen=self.maxlen, approximate=True)
+                    pipe.expire(self.key, PROGRESS_TTL)
+                    await pipe.execute()
+        except Exception as err:
+            logger.warning(f"{err}: Unable to publish progress to {self.key}")
+        finally:
+            self.pending.clear()
+
+    async def publish(self, stage: str, **data):
+        self.update(stage, **data)
+        await self.close()
+
+    async def close(self):
+        """Wait for the queued updates to be written"""
+        await self.flusher if self.flusher is not None else ...
+
+    @contextmanager
+    def activate(self) -> Iterator['Progress']:
+        """Make this the task that `update` publishes to for the current context and the tasks it starts"""
+        token = current.set(self)
+        try:
+            yield self
+        finally:
+            current.reset(token)
+
+    async def events(self, *, last_id: str = "0", block: float = 15, timeout: float = PROGRESS_TTL) -> AsyncIterator[tuple[str, dict | None]]:
+        """Yield (id, event) for every update after last_id until the task is done or failed.
+
+        (last_id, None) is yielded after `block` seconds without updates so that the caller can keep its connection alive.
+        A task that dies without a final update would keep the caller waiting forever, so the stream also ends with an
+        `expired` event once its key is gone and with a `timeout` event after `timeout` seconds.
+        """
+        if (redis := get_redis()) is None:
+            yield last_id, {'stage': 'unavailable'}
+            return
+        if not self.key or not await redis.exists(self.key):
+            yield last_id, {'stage': 'unknown'}
+            return
+
+        deadline = time.monotonic() + timeout
+        while True:
+            streams = await redis.xread({self.key: last_id}, count=100, block=int(block * 1000))
+            if not streams:
+                if not await redis.exists(self.key):
+                    yield last_id, {'stage': 'expired'}
+                    return
+                if time.monotonic() >= deadline:
+                    yield last_id, {'stage': 'timeout'}
+                    return
+                yield last_id, None
+                continue
+            for last_id, fields in streams[0][1]:
+                event = json.loads(fields['event'])
+                yield last_id, event
+                if event['stage'] in FINAL:
+                    return
+
+    async def sse(self, *, last_id: str = "0", block: float = 15, timeout: float = PROGRESS_TTL) -> AsyncIterator[str]:
+        """events as Server-Sent Events, ids are stream ids so that EventSource's Last-Event-ID resumes where it stopped"""
+        async for event_id, event in self.events(last_id=last_id, block=block, timeout=timeout):
+            yield f"id: {event_id}\nevent: progress\ndata: {json.dumps(event)}\n\n" if event is not None else ": keep-alive\n\n"
+
+
+def update(stage: str, **data):
+    if (progress := current.get()) is not None:
+        progress.update(stage, **data)
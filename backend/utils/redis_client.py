@@ -0,0 +1,32 @@
+import asyncio
+from weakref import WeakKeyDictionary
+from logging import getLogger
+
+from redis import asyncio as aioredis
+
+from .env import env
+
+logger = getLogger()
+
+_clients: WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis] = WeakKeyDictionary()
+
+
+def redis_url() -> str:
+    url = env.REDIS_URL or env.CELERY_BROKER_URL or ""
+    return url if url.startswith(('redis://', 'rediss://', 'unix://')) else ""
+
+
+def get_redis() -> aioredis.Redis | None:
+    """The Redis client of the running event loop, None when no redis url is configured"""
+    if not (url := redis_url()):
+        return None
+    loop = asyncio.get_running_loop()
+    if (client := _clients.get(loop)) is None:
+        client = _clients[loop] = aioredis.from_url(url, decode_responses=True)
+    return client
+
+
+async def close_redis():
+    loop = asyncio.get_running_loop()
+    if (client := _clients.pop(loop, None)) is not None:
+        await client.close()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from weakref import WeakKeyDictionary
+from logging import getLogger
+
+from httpx import AsyncClient, Limits
+
+from .env import env
+from .redis_client import get_redis
+
+logger = getLogger()
+
+
+class SessionPool:
+    """Process wide upstream connection pool and bearer token cache.
+
+    One keep-alive AsyncClient is shared by every ClientTransaction running on the same event loop, tokens are cached with their expiry
+    locally and in Redis (when configured) so that web and worker processes reuse each other's logins.
+    """
+    prefix = "moniewatch:token:"
+
+    def __init__(self, *, max_connections: int = 0, margin: float = 60):
+        self.max_connections = max_connections or int(env.API_MAX_CONNECTIONS or 50)
+        self.margin = margin
+        self.clients: WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncClient] = WeakKeyDictionary()
+        self.tokens: dict[str, tuple[str, float]] = {}
+
+    @property
+    def client(self) -> AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+        if client is None or client.is_closed:
+            limits = Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            client = self.clients[loop] = AsyncClient(base_url=env.API_URL, limits=limits)
+        return client
+
+    async def get_token(self, username: str) -> tuple[str, float] | None:
+        token, expires = self.tokens.get(username, ("", 0))
+        if expires > time.time():
+            return token, expires
+
+        try:
+            if (redis := get_redis()) is not None:
+                token = await redis.get(self.prefix + username)
+                ttl = await redis.ttl(self.prefix + username) if token else 0
+                if token and ttl > 0:
+                    expires = time.time() + ttl
+                    self.tokens[username] = token, expires
+                    return token, expires
+        except Exception as err:
+            logger.warning(f"{err}: Unable to read cached token")
+
+    async def set_token(self, username: str, token: str, expires_in: float) -> float:
+        """Cache a token until shortly before it expires and return that expiry as an epoch time"""
+        ttl = max(int(expires_in - self.margin), 1)
+        expires = time.time() + ttl
+        self.tokens[username] = token, expires
+        try:
+            if (redis := get_redis()) is not None:
+                await redis.set(self.prefix + username, token, ex=ttl)
+        except Exception as err:
+            logger.warning(f"{err}: Unable to cache token")
+        return expires
+
+    async def drop_token(self, username: str):
+        self.tokens.pop(username, None)
+        try:
+            if (redis := get_redis()) is not None:
+                await redis.delete(self.prefix + username)
+        except Exception as err:
+            logger.warning(f"{err}: Unable to drop cached token")
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        if (client := self.clients.pop(loop, None)) is not None:
+            await client.aclose()
+
+
+sessions = SessionPool()
@@ -0,0 +1,77 @@
+import asyncio
+import json
+from hashlib import sha256
+from logging import getLogger
+from typing import Awaitable
+
+from .env import env
+from .redis_client import get_redis
+
+logger = getLogger()
+
+RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+REFRESH = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) else return 0 end"
+
+
+def flight_key(**params) -> str:
+    return sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SingleFlight:
+    """At most one task in flight per key across every web process, callers that find one attach to it instead of starting their own.
+
+    A claim is a Redis key holding the id of the task that owns it with a TTL, so a task that dies without releasing it blocks
+    its key for at most `ttl` seconds. A task that runs longer than that keeps its claim by running under `hold`.
+    Without Redis every caller owns its own task.
+    """
+
+    def __init__(self, *, prefix: str, ttl: float):
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def claim(self, key: str, owner: str) -> str:
+        """The id of the task in flight for key, which is owner when this call claimed it"""
+        try:
+            if (redis := get_redis()) is None:
+                return owner
+            for _ in range(3):
+                if await redis.set(self.prefix + key, owner, nx=True, ex=int(self.ttl)):
+                    return owner
+                if (current := await redis.get(self.prefix + key)) is not None:
+                    return current
+        except Exception as err:
+            logger.warning(f"{err}: Unable to claim {self.prefix}{key}")
+        return owner
+
+    async def release(self, key: str, owner: str):
+        """Drop the claim if owner still holds it, a claim that expired and was taken over is left to its new owner"""
+        try:
+            if (redis := get_redis()) is not None:
+                await redis.eval(RELEASE, 1, self.prefix + key, owner)
+        except Exception as err:
+            logger.warning(f"{err}: Unable to release {self.prefix}{key}")
+
+    async def refresh(self, key: str, owner: str) -> bool:
+        """Restart the TTL of the claim if owner still holds it"""
+        try:
+            if (redis := get_redis()) is not None:
+                return bool(await redis.eval(REFRESH, 1, self.prefix + key, owner, int(self.ttl)))
+        except Exception as err:
+            logger.warning(f"{err}: Unable to refresh {self.prefix}{key}")
+        return False
+
+    async def hold(self, key: str, owner: str, coro: Awaitable):
+        """Await coro while refreshing owner's claim on key every third of the TTL, the claim is left for the caller to release"""
+        async def keep():
+            while True:
+                await asyncio.sleep(self.ttl / 3)
+                await self.refresh(key, owner)
+
+        keeper = asyncio.create_task(keep())
+        try:
+            return await coro
+        finally:
+            keeper.cancel()
+
+
+report_flights = SingleFlight(prefix="moniewatch:report-flight:", ttl=int(env.REPORT_FLIGHT_TTL or 900))
@@ -1,34 +1,144 @@
 import asyncio
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, AsyncIterator
+
+from .metrics import queue_depth, queue_running
+
+logger = getLogger()
+
+
+@dataclass
+class TaskResult:
+    index: int
+    args: dict
+    result: Any = None
+    error: BaseException | None = None
+    elapsed: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class QueueStats:
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    latency: float = 0
+    max_latency: float = 0
+    wait: float = 0
+
+    @property
+    def mean_latency(self) -> float:
+        done = self.completed + self.failed
+        return self.latency / done if done else 0
 
 
 class TaskQueue:
-    def __init__(self, coroutine, args: list[dict] = None, workers=0):
+    """Run `coroutine(**args)` for every args dict with at most `workers` running at a time.
+
+    Exceptions and timeouts are captured per task instead of killing the worker, results are kept against the index of their input,
+    and `async for result in queue` yields each TaskResult as soon as it completes.
+    """
+
+    def __init__(self, coroutine, args: list[dict] = None, workers=0, timeout: float | None = None, max_workers: int = 100, name: str = ""):
+        self.name = name or getattr(coroutine, '__name__', "tasks")
         self.queue = asyncio.Queue()
+        self.done: asyncio.Queue[TaskResult] = asyncio.Queue()
         self.coroutine = coroutine
         self.args = args or []
-        self.workers = workers or len(self.args)
-        self.add_all()
+        self.workers = min(workers or len(self.args) or 5, max_workers)
+        self.timeout = timeout
         self.tasks = []
-        self.results = []
+        self.outcomes: dict[int, TaskResult] = {}
+        self.stats = QueueStats()
+        self.count = 0
+        self.add_all()
 
-    def add(self, obj: dict):
-        self.queue.put_nowait(obj)
+    def add(self, obj: dict) -> int:
+        index = self.count
+        self.count += 1
+        self.queue.put_nowait((index, obj, time.monotonic()))
+        self.stats.queued += 1
+        queue_depth.inc(queue=self.name)
+        return index
 
     def add_all(self):
-        [self.queue.put_nowait(obj) for obj in self.args]
+        [self.add(obj) for obj in self.args]
+
+    async def execute(self, index: int, obj: dict) -> TaskResult:
+        start = time.monotonic()
+        try:
+            res = await asyncio.wait_for(self.coroutine(**obj), self.timeout)
+            return TaskResult(index=index, args=obj, result=res, elapsed=time.monotonic() - start)
+        except asyncio.TimeoutError as err:
+            self.stats.timed_out += 1
+            logger.warning(f"Task {index} timed out after {self.timeout}s")
+            return TaskResult(index=index, args=obj, error=err, elapsed=time.monotonic() - start)
+        except Exception as err:
+            logger.error(f"{err}: Task {index} failed")
+            return TaskResult(index=index, args=obj, error=err, elapsed=time.monotonic() - start)
 
     async def worker(self):
         while True:
-            obj = await self.queue.get()
-            res = await self.coroutine(**obj)
-            self.results.append(res)
-            self.queue.task_done()
+            index, obj, queued_at = await self.queue.get()
+            self.stats.queued -= 1
+            self.stats.running += 1
+            queue_depth.dec(queue=self.name)
+            queue_running.inc(queue=self.name)
+            self.stats.wait += time.monotonic() - queued_at
+            try:
+                self.record(await self.execute(index, obj))
+            finally:
+                self.stats.running -= 1
+                queue_running.dec(queue=self.name)
+                self.queue.task_done()
+
+    def record(self, outcome: TaskResult):
+        self.outcomes[outcome.index] = outcome
+        self.stats.latency += outcome.elapsed
+        self.stats.max_latency = max(self.stats.max_latency, outcome.elapsed)
+        if outcome.ok:
+            self.stats.completed += 1
+        else:
+            self.stats.failed += 1
+        self.done.put_nowait(outcome)
 
     def create_tasks(self):
         self.tasks.extend(asyncio.create_task(self.worker()) for _ in range(self.workers or 5))
 
-    async def run(self):
-        self.create_tasks()
-        await self.queue.join()
+    async def stop(self):
         [task.cancel() for task in self.tasks]
         await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+        queue_depth.dec(self.stats.queued, queue=self.name) if self.stats.queued else ...
+
+    async def run(self) -> list:
+        self.create_tasks()
+        await self.queue.join()
+        await self.stop()
+        return self.results
+
+    async def __aiter__(self) -> AsyncIterator[TaskResult]:
+        self.create_tasks() if not self.tasks else ...
+        received = 0
+        try:
+            while received < self.count:
+                yield await self.done.get()
+                received += 1
+        finally:
+            await self.stop()
+
+    @property
+    def results(self) -> list:
+        """Results of the successful tasks in input order"""
+        return [self.outcomes[index].result for index in sorted(self.outcomes) if self.outcomes[index].ok]
+
+    @property
+    def errors(self) -> dict[int, BaseException]:
+        return {index: outcome.error for index, outcome in self.outcomes.items() if not outcome.ok}
@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from .metrics import stage_latency
+
+current: ContextVar['ReportTimings | None'] = ContextVar('report_timings', default=None)
+
+
+@dataclass
+class StageTiming:
+    wall: float = 0
+    cpu: float = 0
+    calls: int = 0
+
+
+@dataclass
+class ReportTimings:
+    """Wall clock and CPU seconds per pipeline stage plus counters (rows, pages, pdf bytes) of one report run.
+
+    Stages overlap when pages are fetched concurrently, so stage wall times are summed per call and can add up to more than `wall`.
+    CPU time is the thread time of the thread the stage ran on, for stages running on the event loop that includes whatever
+    other coroutines ran in between.
+    """
+    stages: dict[str, StageTiming] = field(default_factory=dict)
+    counts: dict[str, int] = field(default_factory=dict)
+    started: float = field(default_factory=time.perf_counter)
+    wall: float = 0
+
+    def add(self, name: str, *, wall: float, cpu: float):
+        timing = self.stages.setdefault(name, StageTiming())
+        timing.wall += wall
+        timing.cpu += cpu
+        timing.calls += 1
+
+    def count(self, name: str, value: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @property
+    def cpu(self) -> float:
+        return sum(timing.cpu for timing in self.stages.values())
+
+    def finish(self) -> 'ReportTimings':
+        self.wall = time.perf_counter() - self.started
+        return self
+
+    @contextmanager
+    def activate(self) -> Iterator['ReportTimings']:
+        """Make this the run that `stage` and `count` record into for the current context and the tasks it starts"""
+        token = current.set(self)
+        try:
+            yield self
+        finally:
+            current.reset(token)
+            self.finish()
+
+
+def record(name: str, *, wall: float, cpu: float):
+    """Record a stage into the stage latency histogram and into the active report run, if there is one"""
+    stage_latency.observe(wall, stage=name)
+    if (timings := current.get()) is not None:
+        timings.add(name, wall=wall, cpu=cpu)
+
+
+@contextmanager
+def stage(name: str):
+    start, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        record(name, wall=time.perf_counter() - start, cpu=time.thread_time() - start_cpu)
+
+
+def count(name: str, value: int = 1):
+    if (timings := current.get()) is not None:
+        timings.count(name, value)
@@ -0,0 +1,62 @@
+import json
+import time
+from logging import getLogger
+
+from .redis_client import get_redis
+
+logger = getLogger()
+
+
+class TTLCache:
+    """Two tier cache of json serialisable values.
+
+    Entries are kept in process for `local_ttl` seconds and in Redis, when configured, for `ttl` seconds so that every uvicorn and
+    celery process shares them. `delete` clears both tiers of the calling process, other processes may serve their local copy
+    for at most `local_ttl` more seconds.
+    """
+
+    def __init__(self, *, prefix: str, ttl: float = 300, local_ttl: float = 30, maxsize: int = 1024):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local_ttl = min(local_ttl, ttl)
+        self.maxsize = maxsize
+        self.local: dict[str, tuple[dict, float]] = {}
+
+    def remember(self, key: str, value: dict):
+        self.local.pop(key, None)
+        if len(self.local) >= self.maxsize:
+            now = time.monotonic()
+            self.local = {k: v for k, v in self.local.items() if v[1] > now}
+            while len(self.local) >= self.maxsize:
+                self.local.pop(next(iter(self.local)))
+        self.local[key] = value, time.monotonic() + self.local_ttl
+
+    async def get(self, key: str) -> dict | None:
+        value, expires = self.local.get(key, (None, 0))
+        if expires > time.monotonic():
+            return value
+        self.local.pop(key, None)
+
+        try:
+            if (redis := get_redis()) is not None and (value := await redis.get(self.prefix + key)) is not None:
+                value = json.loads(value)
+                self.remember(key, value)
+                return value
+        except Exception as err:
+            logger.warning(f"{err}: Unable to read {self.prefix}{key} from redis")
+
+    async def set(self, key: str, value: dict):
+        self.remember(key, value)
+        try:
+            if (redis := get_redis()) is not None:
+                await redis.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+        except Exception as err:
+            logger.warning(f"{err}: Unable to write {self.prefix}{key} to redis")
+
+    async def delete(self, key: str):
+        self.local.pop(key, None)
+        try:
+            if (redis := get_redis()) is not None:
+                await redis.delete(self.prefix + key)
+        except Exception as err:
+            logger.warning(f"{err}: Unable to delete {self.prefix}{key} from redis")
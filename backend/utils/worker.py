@@ -1,34 +1,127 @@
 from logging import getLogger
 import datetime
+import os
 
 from celery import Celery
-from tortoise import run_async
+from celery.schedules import crontab
+from celery.signals import worker_init, worker_process_init, worker_shutdown, worker_process_shutdown
 
-from .functions import get_report as gr, run
+from .functions import get_report as gr, close_days as cd, connect, disconnect
+from .loop import LoopThread, monitor
 from .env import env
+from .metrics import registry
+from .progress import Progress
+from .single_flight import report_flights
 
 from models.aggregator import Aggregator, Agent
+from models.transaction import renderer
 
 logger = getLogger()
 
 app = Celery('workers', broker=env.celery_broker_url, backend="rpc://")
+app.conf.beat_schedule = {'close-days': {'task': 'close_days', 'schedule': crontab(hour=int(env.ROLLUP_HOUR or 3), minute=0)}}
+
+
+async def startup():
+    monitor.start() if monitor.threshold else ...
+    await connect()
+
+
+async def shutdown():
+    monitor.stop()
+    await disconnect()
+
+
+loop = LoopThread(startup=startup, shutdown=shutdown)
+metrics_pid = 0
+
+
+@worker_process_init.connect
+def start_loop(**kwargs):
+    loop.start()
+    serve_metrics()
+
+
+@worker_init.connect
+def start_main(sender=None, **kwargs):
+    """Thread and solo pools run tasks in the main process, so its loop starts before the first task arrives.
+
+    worker_process_init never fires for them, prefork children start their own loop and metrics from start_loop.
+    """
+    if 'prefork' not in str(getattr(sender, 'pool_cls', '')):
+        loop.start()
+        serve_metrics()
+
+
+def serve_metrics():
+    """Expose this process's metrics on WORKER_METRICS_PORT for scraping, only one process per host can hold the port"""
+    global metrics_pid
+    if not (port := int(env.WORKER_METRICS_PORT or 0)) or metrics_pid == os.getpid():
+        return
+    try:
+        registry.serve(port)
+        metrics_pid = os.getpid()
+    except OSError as err:
+        logger.error(f"{err}: Unable to serve worker metrics on port {port}")
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def stop_loop(**kwargs):
+    loop.stop()
+    renderer.shutdown()
 
 
 @app.task(name="get_agents")
-async def get_agents(data: dict):
-    aggregator = Aggregator.parse_obj(data)
-    cor = aggregator.init()
-    run_async(run(cor))
+def get_agents(data: dict):
+    try:
+        aggregator = Aggregator.parse_obj(data)
+        loop.run(aggregator.init())
+    except Exception as exc:
+        logger.error(exc)
 
 
-@app.task(name='get_reports')
-def get_report(agg: dict, data: dict):
+@app.task(name='get_reports', bind=True)
+def get_report(self, agg: dict, data: dict):
+    """`flight` is the single flight key create_report claimed for this task, it is kept alive while the report runs and
+    released however the task ends"""
+    flight = data.pop('flight', "")
     try:
         aggregator = Aggregator.parse_obj(agg)
         data['agents'] = [Agent.parse_obj(obj) for obj in data['agents']] if data['agents'] else None
-        data['start_date'] = datetime.datetime.strptime(data['start_date'].split("T")[0], "%Y-%m-%d")
-        data['end_date'] = datetime.datetime.strptime(data['end_date'].split("T")[0], "%Y-%m-%d")
-        coro = gr(aggregator=aggregator, **data)
-        run_async(run(coro))
+        data['start_date'] = datetime.datetime.strptime(data['start_date'].split("T")[0], "%Y-%m-%d").date()
+        data['end_date'] = datetime.datetime.strptime(data['end_date'].split("T")[0], "%Y-%m-%d").date()
+        loop.run(run_report(flight=flight, aggregator=aggregator, task_id=self.request.id, **data))
+    except Exception as exc:
+        logger.error(exc)
+        report_failed(username=agg.get('username', ""), task_id=self.request.id)
+    finally:
+        release_flight(key=flight, task_id=self.request.id) if flight else ...
+
+
+async def run_report(*, flight: str, task_id: str, **kwargs):
+    report = gr(task_id=task_id, **kwargs)
+    await report_flights.hold(flight, task_id, report) if flight else await report
+
+
+def release_flight(*, key: str, task_id: str):
+    try:
+        loop.run(report_flights.release(key, task_id))
+    except Exception as err:
+        logger.error(f"{err}: Unable to release report flight {key}")
+
+
+def report_failed(*, username: str, task_id: str):
+    """End the progress stream of a report task that failed before generate_report could, so listeners stop waiting"""
+    try:
+        loop.run(Progress(username=username, task_id=task_id).publish("failed", message="Unable to generate report"))
+    except Exception as err:
+        logger.error(f"{err}: Unable to publish the failure of report task {task_id}")
+
+
+@app.task(name='close_days')
+def close_days():
+    try:
+        loop.run(cd())
     except Exception as exc:
         logger.error(exc)